@@ -1,7 +1,13 @@
 from django.contrib import admin
 from .models import Customer
+from .search import search_customers
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ('name', 'email', 'phone')
-    search_fields = ('name', 'email')
+    search_fields = ('name', 'email', 'phone')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_customers(queryset, search_term, limit=None), False
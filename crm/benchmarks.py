@@ -0,0 +1,318 @@
+import json
+import random
+import statistics
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .deletion import delete_customers
+from .models import Customer, Deal
+
+BENCH_EMAIL = 'bench{number}@example.com'
+BENCH_PASSWORD = 'benchpassword123'
+SEED_BATCH_SIZE = 10000
+BULK_DELETE_SIZE = 100
+
+
+def seed_tenants(users, customers_per_user, deals_per_customer, batch_size=SEED_BATCH_SIZE, log=None):
+    # Writes straight through bulk_create. Deal aggregates are computed while
+    # generating instead of replaying signals, and amounts are deterministic
+    # so runs seeded with the same sizes are comparable.
+    User = get_user_model()
+    password = make_password(BENCH_PASSWORD)
+    now = timezone.now()
+
+    for number in range(1, users + 1):
+        email = BENCH_EMAIL.format(number=number)
+        user, _ = User.objects.get_or_create(email=email, defaults={'email_verified': True, 'password': password})
+        existing = user.customers.count()
+
+        for start in range(existing, customers_per_user, batch_size):
+            stop = min(start + batch_size, customers_per_user)
+            with transaction.atomic():
+                customers = Customer.objects.bulk_create([
+                    Customer(
+                        user=user,
+                        name=f"Bench customer {number}-{index}",
+                        email=f"bench{number}-{index}@customers.example.com",
+                        phone=f"{number:03d}{index:09d}"[-15:],
+                        deal_count=deals_per_customer,
+                        deal_total=_deal_amount(index) * deals_per_customer,
+                        last_deal_at=now if deals_per_customer else None,
+                    )
+                    for index in range(start, stop)
+                ])
+                if deals_per_customer:
+                    customer_ids = _ids_for(user, customers, start, stop)
+                    Deal.objects.bulk_create(
+                        [
+                            Deal(customer_id=customer_id, title=f"Deal {deal}", amount=_deal_amount(index))
+                            for index, customer_id in zip(range(start, stop), customer_ids)
+                            for deal in range(deals_per_customer)
+                        ],
+                        batch_size=batch_size,
+                    )
+            if log is not None:
+                log(f"{email}: {stop}/{customers_per_user} customers")
+
+
+def _deal_amount(index):
+    return Decimal(100 + index % 900)
+
+
+def _ids_for(user, customers, start, stop):
+    # bulk_create returns primary keys on PostgreSQL; other backends need a lookup.
+    if all(customer.pk for customer in customers):
+        return [customer.pk for customer in customers]
+    emails = [customer.email for customer in customers]
+    by_email = dict(Customer.objects.filter(user=user, email__in=emails).values_list('email', 'pk'))
+    return [by_email[email] for email in emails]
+
+
+def bench_user(number=1):
+    return get_user_model().objects.get(email=BENCH_EMAIL.format(number=number))
+
+
+class HttpClient:
+
+    # Talks HTTP to a running server over one keep-alive connection, so runs
+    # go through the real server, middleware stack and database connection
+    # handling. Keeps cookies and sends the CSRF token like a browser would.
+    # Methods return the response status; the body is left in self.body.
+
+    def __init__(self, base_url, cookies=None, timeout=30):
+        parts = urlsplit(base_url)
+        connection_class = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+        self.base_url = base_url.rstrip('/')
+        self.prefix = parts.path.rstrip('/')
+        self.connection = connection_class(parts.netloc, timeout=timeout)
+        self.cookies = dict(cookies or {})
+        self.body = b''
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def post(self, path, data=None, json_data=None):
+        if json_data is not None:
+            return self.request('POST', path, json.dumps(json_data), 'application/json')
+        return self.request('POST', path, urlencode(data or {}, doseq=True), 'application/x-www-form-urlencoded')
+
+    def log_in(self, email, password):
+        # The login page sets the CSRF cookie the form post needs.
+        self.get(reverse('auth:login'))
+        return self.post(reverse('auth:login'), {'email': email, 'password': password}) == 302
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {'Referer': self.base_url + path}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        if method != 'GET':
+            headers['X-CSRFToken'] = self.cookies.get(settings.CSRF_COOKIE_NAME, '')
+        if content_type:
+            headers['Content-Type'] = content_type
+
+        try:
+            response, self.body = self._send(method, path, body, headers)
+        except (HTTPException, OSError):
+            # The server closed an idle keep-alive connection; retry once.
+            self.connection.close()
+            response, self.body = self._send(method, path, body, headers)
+
+        for header in response.headers.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                if morsel.value and morsel['max-age'] != '0':
+                    self.cookies[name] = morsel.value
+                else:
+                    self.cookies.pop(name, None)
+        return response.status
+
+    def close(self):
+        self.connection.close()
+
+    def _send(self, method, path, body, headers):
+        self.connection.request(method, self.prefix + path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+
+class Scenario:
+
+    # One benchmark: setup() runs once, request(client) once per iteration
+    # and returns the response status, which succeeded() then judges.
+
+    login = True
+
+    def __init__(self, user):
+        self.user = user
+
+    def setup(self):
+        pass
+
+    def request(self, client):
+        raise NotImplementedError
+
+    def succeeded(self, status, client):
+        return status < 400
+
+
+class CustomerListScenario(Scenario):
+    name = 'customer_list'
+
+    def request(self, client):
+        return client.get(reverse('crm:customer_list'))
+
+
+class CustomerDetailScenario(Scenario):
+    name = 'customer_detail'
+
+    def setup(self):
+        self.ids = list(Customer.objects.filter(user=self.user).order_by('-id').values_list('pk', flat=True)[:1000])
+
+    def request(self, client):
+        return client.get(reverse('crm:customer_detail', kwargs={'pk': random.choice(self.ids)}))
+
+
+class BulkDeleteScenario(Scenario):
+    # Consumes seeded customers: every request deletes BULK_DELETE_SIZE of them.
+    name = 'bulk_delete'
+
+    def setup(self):
+        self.lock = threading.Lock()
+        self.ids = list(Customer.objects.filter(user=self.user).order_by('id').values_list('pk', flat=True)[:100000])
+
+    def request(self, client):
+        with self.lock:
+            ids, self.ids = self.ids[:BULK_DELETE_SIZE], self.ids[BULK_DELETE_SIZE:]
+        return client.post(reverse('crm:customer_list'), json_data={'ids': ids})
+
+    def succeeded(self, status, client):
+        # The view reports failed deletes as 200 with success false.
+        if status >= 400:
+            return False
+        try:
+            return json.loads(client.body).get('success') is True
+        except ValueError:
+            return False
+
+
+class LoginScenario(Scenario):
+    name = 'login'
+    login = False
+
+    def request(self, client):
+        if settings.CSRF_COOKIE_NAME not in client.cookies:
+            client.get(reverse('auth:login'))
+        status = client.post(reverse('auth:login'), {'email': self.user.email, 'password': BENCH_PASSWORD})
+        client.cookies.pop(settings.SESSION_COOKIE_NAME, None)
+        return status
+
+
+class SignupScenario(Scenario):
+    name = 'signup'
+    login = False
+
+    def request(self, client):
+        if settings.CSRF_COOKIE_NAME not in client.cookies:
+            client.get(reverse('auth:signup'))
+        email = f"bench-signup-{uuid.uuid4().hex}@example.com"
+        return client.post(reverse('auth:signup'), {
+            'email': email, 'password': BENCH_PASSWORD, 'confirm_password': BENCH_PASSWORD,
+        })
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (
+    CustomerListScenario, CustomerDetailScenario, BulkDeleteScenario, LoginScenario, SignupScenario,
+)}
+
+
+def run_scenario(scenario, base_url, requests, concurrency, cookies=None):
+    # cookies are the session of an earlier log_in(), shared by every
+    # client of a scenario that needs to be logged in.
+    scenario.setup()
+    local = threading.local()
+    clients = []
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run_one(_):
+        nonlocal errors
+        if not hasattr(local, 'client'):
+            local.client = HttpClient(base_url, cookies if scenario.login else None)
+            with lock:
+                clients.append(local.client)
+
+        started = time.perf_counter()
+        status = scenario.request(local.client)
+        elapsed = time.perf_counter() - started
+        succeeded = scenario.succeeded(status, local.client)
+        with lock:
+            latencies.append(elapsed)
+            if not succeeded:
+                errors += 1
+
+    started = time.perf_counter()
+    try:
+        if concurrency == 1:
+            for iteration in range(requests):
+                run_one(iteration)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(run_one, range(requests)))
+    finally:
+        for client in clients:
+            client.close()
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def summarize(latencies, errors, elapsed):
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+    }
+
+
+def compare(baseline, current, threshold):
+    # Returns (scenario, metric, before, after, change) for every p95/p99 or
+    # throughput that got worse by more than threshold (a fraction).
+    regressions = []
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        for metric in ('p95_ms', 'p99_ms'):
+            if before[metric] and (result[metric] - before[metric]) / before[metric] > threshold:
+                regressions.append((name, metric, before[metric], result[metric], result[metric] / before[metric] - 1))
+        if before['throughput_rps'] and (before['throughput_rps'] - result['throughput_rps']) / before['throughput_rps'] > threshold:
+            regressions.append((
+                name, 'throughput_rps', before['throughput_rps'], result['throughput_rps'],
+                result['throughput_rps'] / before['throughput_rps'] - 1,
+            ))
+    return regressions
+
+
+def delete_bench_tenants():
+    # Only accounts created by seed_tenants and SignupScenario.
+    users = get_user_model().objects.filter(email__regex=r'^bench(\d+|-signup-[0-9a-f]+)@example\.com$')
+    for user in users:
+        ids = list(user.customers.values_list('pk', flat=True))
+        delete_customers(user.pk, ids)
+        user.delete()
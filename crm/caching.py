@@ -0,0 +1,124 @@
+import hashlib
+import math
+import time
+
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+
+from crm_project_vacancy.routers import mark_sticky
+
+CUSTOMER_PAGE_TIMEOUT = 300
+VERSION_KEY = 'crm:customers:version:{user_id}'
+CHANGED_AT_KEY = 'crm:customers:changed_at:{user_id}'
+PAGE_KEY = 'crm:customers:page:{user_id}:{version}:{params}'
+HITS_KEY = 'crm:customers:cache:hits'
+MISSES_KEY = 'crm:customers:cache:misses'
+
+
+def get_list_version(user_id):
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        # Seed with the clock rather than 1 so an evicted counter can never
+        # resurrect pages cached under an older version.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_list_version(user_id):
+    # Every writer that changes the list ends up here, including Celery jobs
+    # and commands that bypass ReplicaStickinessMiddleware. Without the
+    # stickiness, the refetch a REFRESH event triggers could read a lagging
+    # replica and cache that page under the new version.
+    if settings.DATABASE_REPLICAS:
+        mark_sticky(user_id)
+    cache.set(CHANGED_AT_KEY.format(user_id=user_id), time.time(), timeout=None)
+
+    key = VERSION_KEY.format(user_id=user_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
+
+
+def get_list_changed_at(user_id):
+    key = CHANGED_AT_KEY.format(user_id=user_id)
+    timestamp = cache.get(key)
+    if timestamp is None:
+        # Evicted: the last change is unknown, and nothing derived from the
+        # rows can account for deletions. Answer without a date this time and
+        # restart the clock past the whole second every earlier
+        # Last-Modified was truncated to.
+        cache.add(key, math.floor(time.time()) + 1, timeout=None)
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def get_cached_page(user_id, params, build_page):
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    key = PAGE_KEY.format(user_id=user_id, version=get_list_version(user_id), params=digest)
+
+    page = cache.get(key)
+    if page is not None:
+        _count(HITS_KEY)
+        return page
+
+    _count(MISSES_KEY)
+    page = build_page()
+    cache.set(key, page, CUSTOMER_PAGE_TIMEOUT)
+    return page
+
+
+def get_customer_count(user_id, queryset):
+    return get_cached_page(user_id, ('count',), queryset.count)
+
+
+def cache_stats():
+    values = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = values.get(HITS_KEY, 0), values.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+# Validators for django.views.decorators.http.condition. They only touch the
+# cache, so a 304 never runs the list query or the template.
+
+def customer_list_etag(request, *args, **kwargs):
+    # The page embeds the CSRF token, so a new secret must not be served a
+    # stale page. get_token() masks randomly on every call; hash the secret.
+    get_token(request)
+    parts = (
+        request.user.pk,
+        get_list_version(request.user.pk),
+        request.GET.get('q', '').strip(),
+        request.GET.get('cursor', ''),
+        request.GET.get('sort', ''),
+        bool(request.htmx),
+        request.META.get('CSRF_COOKIE'),
+    )
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def customer_list_last_modified(request, *args, **kwargs):
+    return get_list_changed_at(request.user.pk)
+
+
+def customer_detail_etag(request, pk, *args, **kwargs):
+    parts = (request.user.pk, pk, get_list_version(request.user.pk), bool(request.htmx))
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def customer_detail_last_modified(request, pk, *args, **kwargs):
+    return get_list_changed_at(request.user.pk)
@@ -0,0 +1,42 @@
+import logging
+
+from celery import shared_task
+
+from .changes import purge_tombstones
+from .deletion import DONE, FAILED, RUNNING, delete_customers, set_job
+from .rollups import ROLLUP_BATCH_SIZE, roll_up_deals
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def delete_customers_job(job_id, user_id, ids):
+    set_job(job_id, status=RUNNING)
+
+    def report(deleted, processed):
+        set_job(job_id, deleted=deleted, processed=processed)
+
+    try:
+        deleted = delete_customers(user_id, ids, on_progress=report)
+    except Exception as exc:
+        logger.exception("Bulk delete job %s failed", job_id)
+        set_job(job_id, status=FAILED, error=str(exc))
+        raise
+
+    set_job(job_id, status=DONE, deleted=deleted, processed=len(ids))
+    return deleted
+
+
+@shared_task
+def update_deal_rollups(batch_size=ROLLUP_BATCH_SIZE):
+    processed = roll_up_deals(batch_size)
+    # A full batch means there is more backlog; keep going without waiting
+    # for the next scheduled run.
+    if processed == batch_size:
+        update_deal_rollups.delay(batch_size)
+    return processed
+
+
+@shared_task
+def purge_customer_tombstones():
+    return purge_tombstones()
@@ -0,0 +1,86 @@
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+from django.utils import timezone
+
+from .models import Customer, CustomerTombstone
+from .pagination import NEXT, decode_cursor, encode_cursor
+
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_PAGE_SIZE = 1000
+# Rows stamped later than this are left for the next call, so a transaction
+# that commits a little after its timestamp is not skipped.
+CHANGES_SETTLE = datetime.timedelta(seconds=5)
+TOMBSTONE_RETENTION = datetime.timedelta(days=30)
+
+
+class CursorExpired(Exception):
+    pass
+
+
+async def customer_changes(user, cursor=None, limit=CHANGES_PAGE_SIZE, now=None):
+    # One page of the user's changes after cursor: customers created or
+    # updated, and ids of deleted ones, each read in (timestamp, id) order
+    # with its own position in the cursor. A client is in sync once
+    # has_more is false. Without a cursor every customer is returned and
+    # earlier deletions are skipped; a cursor older than the tombstones
+    # raises CursorExpired and the client must start over.
+    now = now or timezone.now()
+    until = now - CHANGES_SETTLE
+
+    if cursor:
+        updated_after, deleted_after = _parse_cursor(cursor)
+        if deleted_after[0] < now - TOMBSTONE_RETENTION:
+            raise CursorExpired()
+    else:
+        updated_after, deleted_after = None, (until, 0)
+
+    customers, updated_after, more_customers = await _page(
+        Customer.objects.filter(user=user), 'updated_at', updated_after, until, limit
+    )
+    tombstones, deleted_after, more_tombstones = await _page(
+        CustomerTombstone.objects.filter(user=user), 'deleted_at', deleted_after, until, limit
+    )
+    return {
+        'customers': customers,
+        'deleted': [tombstone.customer_id for tombstone in tombstones],
+        'cursor': encode_cursor(NEXT, [*updated_after, *deleted_after]),
+        'has_more': more_customers or more_tombstones,
+    }
+
+
+async def _page(queryset, field, after, until, limit):
+    queryset = queryset.filter(**{f'{field}__lt': until})
+    if after is not None:
+        queryset = queryset.filter(Q(**{f'{field}__gt': after[0]}) | Q(**{field: after[0], 'id__gt': after[1]}))
+
+    rows = [row async for row in queryset.order_by(field, 'id')[:limit + 1]]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (getattr(rows[-1], field), rows[-1].pk), True
+    # Drained: resume from the cutoff so an idle client's cursor keeps up.
+    return rows, (until, 0), False
+
+
+def _parse_cursor(cursor):
+    _, values = decode_cursor(cursor)
+    if len(values) != 4:
+        raise Http404("Invalid cursor.")
+
+    timestamp = Customer._meta.get_field('updated_at')
+    try:
+        updated_at, deleted_at = timestamp.to_python(values[0]), timestamp.to_python(values[2])
+        updated_id, deleted_id = int(values[1]), int(values[3])
+    except (ValidationError, TypeError, ValueError):
+        raise Http404("Invalid cursor.")
+    if updated_at is None or deleted_at is None:
+        raise Http404("Invalid cursor.")
+    return (updated_at, updated_id), (deleted_at, deleted_id)
+
+
+def purge_tombstones(now=None):
+    cutoff = (now or timezone.now()) - TOMBSTONE_RETENTION
+    deleted, _ = CustomerTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import Case, DateTimeField, DecimalField, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .caching import bump_list_version
+from .events import REFRESH, publish_customer_event
+from .forms import DealIngestForm
+from .importers import ImportReport
+from .models import Customer, Deal
+
+DEAL_INGEST_BATCH_SIZE = 1000
+DEAL_INGEST_MAX_ROWS = 10000
+
+
+def ingest_deals(user, rows, batch_size=DEAL_INGEST_BATCH_SIZE):
+    # Valid rows are inserted with bulk_create; invalid ones are reported by
+    # their index in the request, like import_customers reports lines.
+    report = ImportReport()
+    valid = []
+
+    for index, row in enumerate(rows):
+        report.processed += 1
+        if not isinstance(row, dict):
+            report.add_error(index, ["Expected a JSON object"])
+            continue
+
+        form = DealIngestForm(data=row)
+        if not form.is_valid():
+            report.add_error(index, [
+                f"{field.capitalize()}: {message}"
+                for field, messages in form.errors.items() for message in messages
+            ])
+            continue
+        valid.append((index, form.cleaned_data))
+
+    owned = set(
+        Customer.objects.filter(user=user, pk__in={data['customer'] for _, data in valid}).values_list('pk', flat=True)
+    )
+    deals = []
+    for index, data in valid:
+        if data['customer'] not in owned:
+            report.add_error(index, ["Customer: Select a valid choice. That choice is not one of the available choices."])
+            continue
+        deals.append(Deal(customer_id=data['customer'], title=data['title'], amount=data['amount']))
+
+    for start in range(0, len(deals), batch_size):
+        batch = deals[start:start + batch_size]
+        with transaction.atomic():
+            Deal.objects.bulk_create(batch)
+            add_to_deal_aggregates(batch)
+
+    if deals:
+        bump_list_version(user.pk)
+        publish_customer_event(user.pk, REFRESH)
+    # Ownership errors are found after validation; report in row order.
+    report.errors.sort(key=lambda error: error['line'])
+    return report
+
+
+def add_to_deal_aggregates(deals):
+    # bulk_create sends no post_save, so the Customer aggregates are updated
+    # here with one UPDATE for the whole batch. The rollups pick new deals up
+    # from their high-water mark on their own.
+    totals = {}
+    for deal in deals:
+        count, amount, latest = totals.get(deal.customer_id, (0, 0, deal.created_at))
+        totals[deal.customer_id] = (count + 1, amount + deal.amount, max(latest, deal.created_at))
+
+    def per_customer(position, output_field):
+        return Case(
+            *[When(pk=customer_id, then=Value(values[position])) for customer_id, values in totals.items()],
+            output_field=output_field,
+        )
+
+    latest = per_customer(2, DateTimeField())
+    Customer.objects.filter(pk__in=totals).update(
+        deal_count=F('deal_count') + per_customer(0, IntegerField()),
+        deal_total=F('deal_total') + per_customer(1, DecimalField(max_digits=14, decimal_places=2)),
+        last_deal_at=Greatest(Coalesce('last_deal_at', latest), latest),
+        updated_at=timezone.now(),
+    )
@@ -0,0 +1,114 @@
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .caching import bump_list_version
+from .events import REFRESH, publish_customer_event
+from .models import Customer, CustomerTombstone, Deal, DealDailyRollup
+
+DELETE_CHUNK_SIZE = 1000
+# Selections larger than this are deleted by a Celery job.
+BULK_DELETE_ASYNC_THRESHOLD = 5000
+JOB_KEY = 'crm:bulk_delete:{job_id}'
+JOB_TIMEOUT = 60 * 60
+# Tables with a customer_id foreign key, removed along with the customer.
+CUSTOMER_CHILDREN = (Deal, DealDailyRollup)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def delete_customers(user_id, ids, chunk_size=DELETE_CHUNK_SIZE, on_progress=None):
+    # Deletes with one statement per chunk instead of Django's collector,
+    # which would load every customer and deal into memory. Deals and
+    # rollups are removed by the database: ON DELETE CASCADE on PostgreSQL
+    # (see add_customer_cascades), explicit DELETEs elsewhere. Tombstones for
+    # delta sync are written in the same transaction. Returns the number of
+    # customers deleted; ids the user does not own are skipped.
+    connection = connections[DEFAULT_DB_ALIAS]
+    deleted = 0
+
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        with transaction.atomic(), connection.cursor() as cursor:
+            deleted_ids = _delete_chunk(connection, cursor, user_id, chunk)
+            CustomerTombstone.objects.bulk_create(
+                [CustomerTombstone(user_id=user_id, customer_id=pk) for pk in deleted_ids]
+            )
+        deleted += len(deleted_ids)
+        if on_progress:
+            on_progress(deleted, min(start + chunk_size, len(ids)))
+
+    # Raw deletes send no post_delete signals.
+    if deleted:
+        bump_list_version(user_id)
+        publish_customer_event(user_id, REFRESH)
+    return deleted
+
+
+def _delete_chunk(connection, cursor, user_id, ids):
+    quote = connection.ops.quote_name
+    customers = quote(Customer._meta.db_table)
+
+    if connection.vendor == 'postgresql':
+        cursor.execute(f'DELETE FROM {customers} WHERE user_id = %s AND id = ANY(%s) RETURNING id', [user_id, ids])
+        return [row[0] for row in cursor.fetchall()]
+
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f'SELECT id FROM {customers} WHERE user_id = %s AND id IN ({placeholders})', [user_id, *ids])
+    owned = [row[0] for row in cursor.fetchall()]
+    for model in CUSTOMER_CHILDREN:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} WHERE customer_id IN '
+            f'(SELECT id FROM {customers} WHERE user_id = %s AND id IN ({placeholders}))',
+            [user_id, *ids],
+        )
+    cursor.execute(f'DELETE FROM {customers} WHERE user_id = %s AND id IN ({placeholders})', [user_id, *ids])
+    return owned
+
+
+def add_customer_cascades(using=DEFAULT_DB_ALIAS, **kwargs):
+    # Django emulates on_delete in Python, so foreign keys are created
+    # without ON DELETE. Recreate the customer_id ones with CASCADE so
+    # delete_customers can rely on the database. Runs after migrate, like
+    # the search indexes.
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+
+    quote = connection.ops.quote_name
+    for model in CUSTOMER_CHILDREN:
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT con.conname, con.confdeltype
+                FROM pg_constraint con
+                JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = ANY(con.conkey)
+                WHERE con.conrelid = %s::regclass AND con.contype = 'f' AND att.attname = 'customer_id'
+                """,
+                [table],
+            )
+            constraints = cursor.fetchall()
+
+        with connection.schema_editor() as schema_editor:
+            for name, on_delete in constraints:
+                if on_delete == 'c':
+                    continue
+                schema_editor.execute(
+                    f'ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(name)}, '
+                    f'ADD CONSTRAINT {quote(name)} FOREIGN KEY (customer_id) '
+                    f'REFERENCES {quote(Customer._meta.db_table)} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED'
+                )
+
+
+def get_job(job_id):
+    return cache.get(JOB_KEY.format(job_id=job_id))
+
+
+def set_job(job_id, **state):
+    job = get_job(job_id) or {}
+    job.update(state)
+    cache.set(JOB_KEY.format(job_id=job_id), job, timeout=JOB_TIMEOUT)
+    return job
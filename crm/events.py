@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import threading
+
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'crm:customer_events:{user_id}'
+CHANNEL_PATTERN = 'crm:customer_events:*'
+SUBSCRIBER_QUEUE_SIZE = 100
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+# Sent after bulk changes (imports, bulk deletes, aggregate rebuilds) and to
+# clients that fell behind: reload the list instead of patching rows.
+REFRESH = 'refresh'
+
+
+def publish_customer_event(user_id, action, customer_id=None):
+    # Published after commit, so a client never fetches a row it cannot see yet.
+    event = {'action': action, 'id': customer_id}
+    transaction.on_commit(lambda: customer_events.publish(user_id, event))
+
+
+class CustomerEventHub:
+
+    # Fans customer change events out to the SSE connections of this process.
+    # Every connection registers a bounded asyncio.Queue; one listener task
+    # per process holds a single Redis pattern subscription and hands each
+    # message to the queues of its user. Without a Redis URL (tests, local
+    # development) publish() delivers straight to this process's queues.
+
+    def __init__(self, redis_url=None, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.redis_url = redis_url
+        self.queue_size = queue_size
+        self._client = None
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._listener = None
+
+    @property
+    def client(self):
+        if self._client is None and self.redis_url:
+            import redis
+
+            self._client = redis.Redis.from_url(self.redis_url)
+        return self._client
+
+    def publish(self, user_id, event):
+        if self.client is None:
+            self.deliver(user_id, event)
+            return
+        try:
+            self.client.publish(CHANNEL.format(user_id=user_id), json.dumps(event))
+        except Exception as exc:
+            # A missed event only leaves other tabs stale; never fail the write.
+            logger.warning("Could not publish customer event for user %s: %s", user_id, exc)
+
+    def deliver(self, user_id, event):
+        # Safe to call from any thread: queues are only touched on their loop.
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._put, queue, event)
+
+    def deliver_to_all(self, event):
+        with self._lock:
+            user_ids = list(self._subscribers)
+        for user_id in user_ids:
+            self.deliver(user_id, event)
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.queue_size))
+        with self._lock:
+            self._subscribers[user_id].add(subscriber)
+        if self.redis_url:
+            self._ensure_listener()
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers[user_id].discard(subscriber)
+                if not self._subscribers[user_id]:
+                    del self._subscribers[user_id]
+
+    @staticmethod
+    def _put(queue, event):
+        # A client that stopped reading gets one refresh instead of a backlog.
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            event = {'action': REFRESH, 'id': None}
+        queue.put_nowait(event)
+
+    def _ensure_listener(self):
+        loop = asyncio.get_running_loop()
+        if self._listener is None or self._listener.done() or self._listener.get_loop() is not loop:
+            self._listener = loop.create_task(self._listen())
+
+    async def _listen(self):
+        import redis.asyncio
+
+        while True:
+            try:
+                async with redis.asyncio.Redis.from_url(self.redis_url) as client, client.pubsub() as pubsub:
+                    await pubsub.psubscribe(CHANNEL_PATTERN)
+                    async for message in pubsub.listen():
+                        if message['type'] != 'pmessage':
+                            continue
+                        user_id = int(message['channel'].rsplit(b':', 1)[1])
+                        self.deliver(user_id, json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Customer event subscription lost, reconnecting: %s", exc)
+                # Whatever was published meanwhile is gone.
+                self.deliver_to_all({'action': REFRESH, 'id': None})
+                await asyncio.sleep(1)
+
+
+customer_events = CustomerEventHub(settings.CUSTOMER_EVENTS_REDIS_URL)
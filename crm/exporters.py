@@ -0,0 +1,84 @@
+import csv
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+
+from .models import Customer
+
+EXPORT_FIELDS = ('id', 'name', 'email', 'phone', 'created_at')
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/jsonl', 'jsonl'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+class Echo:
+
+    def write(self, value):
+        return value
+
+
+def export_rows(user):
+    # iterator() streams from a server-side cursor on PostgreSQL instead of
+    # loading the whole book into memory.
+    return Customer.objects.filter(user=user).order_by('created_at', 'id').values_list(
+        *EXPORT_FIELDS
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record['created_at'] = record['created_at'].isoformat()
+        yield json.dumps(record) + '\n'
+
+
+def iter_export(user, export_format, compress=False):
+    rows = export_rows(user)
+    lines = iter_csv(rows) if export_format == 'csv' else iter_jsonl(rows)
+    chunks = _buffered(lines)
+    return _gzipped(chunks) if compress else chunks
+
+
+async def aiter_export(user, export_format, compress=False):
+    # iter_export for ASGI servers, which would otherwise read a sync
+    # iterator to the end before sending the first byte. Each chunk is
+    # produced in the request's thread, where the cursor lives, and sent
+    # as soon as it is ready.
+    chunks = iter_export(user, export_format, compress)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
+def _buffered(lines):
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
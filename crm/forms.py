@@ -1,7 +1,7 @@
 from django import forms
 from django.core.validators import RegexValidator
 
-from .models import Customer
+from .models import Customer, Deal
 
 class CustomerForm(forms.ModelForm):
 
@@ -19,3 +19,48 @@ class CustomerForm(forms.ModelForm):
     class Meta:
         model = Customer
         fields = ['name', 'email', 'phone']
+
+
+class CustomerImportUploadForm(forms.Form):
+
+    file = forms.FileField()
+    format = forms.ChoiceField(
+        choices=[('', 'Detect from file name'), ('csv', 'CSV'), ('jsonl', 'JSON Lines')],
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+
+class DealForm(forms.ModelForm):
+
+    # The customer is picked through the search API and posted as an id, so
+    # the page never lists every customer; ownership is checked in
+    # clean_customer. customer_search only carries the picked name back when
+    # the form is shown again.
+    customer_search = forms.CharField(required=False)
+
+    class Meta:
+        model = Deal
+        fields = ['title', 'customer', 'amount']
+        widgets = {'customer': forms.HiddenInput}
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        if self.instance.customer_id:
+            self.fields['customer_search'].initial = self.instance.customer.name
+
+    def clean_customer(self):
+        customer = self.cleaned_data['customer']
+        if self.user is None or customer.user_id != self.user.pk:
+            raise forms.ValidationError("Select one of your customers.")
+        return customer
+
+
+class DealIngestForm(forms.Form):
+
+    # One row of the bulk deal API. customer is a plain id; ownership is
+    # checked for the whole batch with one query.
+    customer = forms.IntegerField()
+    title = forms.CharField(max_length=255)
+    amount = forms.DecimalField(max_digits=10, decimal_places=2)
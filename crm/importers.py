@@ -0,0 +1,149 @@
+import csv
+import json
+import os
+
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import bump_list_version
+from .events import REFRESH, publish_customer_event
+from .forms import CustomerForm
+from .models import Customer
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+
+class CustomerImportForm(CustomerForm):
+
+    # Email conflicts are resolved by the batched upsert, so skip the
+    # per-row uniqueness query ModelForm would otherwise run.
+    def validate_unique(self):
+        pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.errors = []
+
+    @property
+    def imported(self):
+        return self.processed - self.failed
+
+    def add_error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'processed': self.processed,
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    return 'jsonl' if extension in ('.jsonl', '.ndjson') else 'csv'
+
+
+def iter_rows(stream, file_format):
+    # Bytes that are not UTF-8 or broken CSV quoting leave no way to find the
+    # next row, so they end the read with one error for the failing line.
+    line = 0
+    try:
+        for line, row, error in _parse_rows(stream, file_format):
+            yield line, row, error
+    except UnicodeDecodeError:
+        yield line + 1, None, "The file is not valid UTF-8; the rest of it was skipped."
+    except csv.Error as exc:
+        yield line + 1, None, f"Malformed CSV ({exc}); the rest of the file was skipped."
+
+
+def _parse_rows(stream, file_format):
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, "Invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, row, None
+
+
+def import_customers(user, stream, file_format, batch_size=IMPORT_BATCH_SIZE):
+    report = ImportReport()
+    batch = {}
+
+    for line, row, error in iter_rows(stream, file_format):
+        report.processed += 1
+        if error:
+            report.add_error(line, [error])
+            continue
+
+        form = CustomerImportForm(data=row)
+        if not form.is_valid():
+            report.add_error(line, [
+                f"{field.capitalize()}: {message}"
+                for field, messages in form.errors.items() for message in messages
+            ])
+            continue
+
+        customer = form.save(commit=False)
+        customer.user = user
+        # A repeated email inside one batch would hit the same row twice in a
+        # single upsert statement, so the later row wins.
+        batch[customer.email] = (line, customer)
+
+        if len(batch) >= batch_size:
+            _write_batch(user, batch, report)
+            batch = {}
+
+    if batch:
+        _write_batch(user, batch, report)
+
+    # Ownership errors are found when a batch is written, after the
+    # validation errors of its later lines.
+    report.errors.sort(key=lambda error: error['line'])
+    return report
+
+
+def _write_batch(user, batch, report):
+    # New emails are inserted without touching existing rows. Existing ones
+    # are then locked and updated only where this user owns them, so an
+    # email another tenant inserts concurrently is reported, not overwritten.
+    with transaction.atomic():
+        Customer.objects.bulk_create([customer for _, customer in batch.values()], ignore_conflicts=True)
+
+        changed = []
+        now = timezone.now()
+        existing_rows = Customer.objects.select_for_update().filter(email__in=list(batch)).only(
+            'user_id', 'email', 'name', 'phone',
+        ).order_by('pk')
+        for existing in existing_rows:
+            line, customer = batch[existing.email]
+            if existing.user_id != user.pk:
+                report.add_error(line, ["Email: This email belongs to a customer of another account."])
+            elif (existing.name, existing.phone) != (customer.name, customer.phone):
+                existing.name, existing.phone, existing.updated_at = customer.name, customer.phone, now
+                changed.append(existing)
+        Customer.objects.bulk_update(changed, ['name', 'phone', 'updated_at'])
+
+    # Bulk writes send no post_save signals.
+    bump_list_version(user.pk)
+    publish_customer_event(user.pk, REFRESH)
@@ -0,0 +1,77 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from crm.benchmarks import HttpClient
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure requests per second for a page of a running server. Restart the server once per "
+        "DB_CONN_MODE (none, persistent, pool) to compare; on PostgreSQL the number of database "
+        "connections the server opened is reported as well."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help="Server to benchmark.")
+        parser.add_argument('--user', required=True, help="Email of the account to log in as.")
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--path', default='/customers/')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=8)
+
+    def handle(self, *args, **options):
+        client = HttpClient(options['base_url'])
+        try:
+            if not client.log_in(options['user'], options['password']):
+                raise CommandError(f"Could not log in to {options['base_url']} as {options['user']}.")
+        except OSError as e:
+            raise CommandError(f"Could not reach {options['base_url']}: {e}")
+        finally:
+            client.close()
+
+        local = threading.local()
+        clients = []
+        lock = threading.Lock()
+
+        def run(_):
+            if not hasattr(local, 'client'):
+                local.client = HttpClient(options['base_url'], client.cookies)
+                with lock:
+                    clients.append(local.client)
+            status = local.client.get(options['path'])
+            if status != 200:
+                raise CommandError(f"{options['path']} returned {status}.")
+
+        sessions_before = _server_sessions()
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                list(executor.map(run, range(options['requests'])))
+        finally:
+            for http_client in clients:
+                http_client.close()
+        elapsed = time.perf_counter() - started
+        sessions_after = _server_sessions()
+
+        connects = 'n/a' if sessions_before is None else sessions_after - sessions_before
+        self.stdout.write(
+            f"url={options['base_url']}{options['path']} requests={options['requests']} "
+            f"concurrency={options['concurrency']} rps={options['requests'] / elapsed:.1f} db_connects={connects}"
+        )
+
+
+def _server_sessions():
+    # Sessions ever opened to the database (PostgreSQL 14+). Backends report
+    # them with up to a second of delay, hence the pause. This command's own
+    # connection is already open, so the difference is the server's.
+    if connection.vendor != 'postgresql':
+        return None
+    time.sleep(1)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_stat_clear_snapshot()')
+        cursor.execute('SELECT sessions FROM pg_stat_database WHERE datname = current_database()')
+        return cursor.fetchone()[0]
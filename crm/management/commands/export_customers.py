@@ -0,0 +1,38 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.exporters import EXPORT_FORMATS, iter_export
+
+
+class Command(BaseCommand):
+    help = "Stream a user's customers to a CSV or JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help="Email of the account to export.")
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip.")
+        parser.add_argument('--output', default='-', help="File to write, or '-' for stdout.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(email=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"A user with email {options['user']} does not exist.")
+
+        chunks = iter_export(user, options['format'], compress=options['gzip'])
+
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        try:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        except OSError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,42 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.importers import IMPORT_BATCH_SIZE, IMPORT_FORMATS, detect_format, import_customers
+
+
+class Command(BaseCommand):
+    help = "Stream customers from a CSV or JSON Lines file into a user's account."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' to read from stdin.")
+        parser.add_argument('--user', required=True, help="Email of the account that owns the customers.")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(email=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"A user with email {options['user']} does not exist.")
+
+        path = options['path']
+        file_format = options['format'] or detect_format(path)
+
+        if path == '-':
+            report = import_customers(user, sys.stdin, file_format, options['batch_size'])
+        else:
+            try:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    report = import_customers(user, stream, file_format, options['batch_size'])
+            except OSError as e:
+                raise CommandError(str(e))
+
+        for error in report.errors:
+            self.stderr.write(f"Line {error['line']}: {'; '.join(error['errors'])}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {report.processed} rows: {report.imported} imported, {report.failed} failed."
+        ))
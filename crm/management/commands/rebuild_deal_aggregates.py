@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from crm.caching import bump_list_version
+from crm.events import REFRESH, publish_customer_event
+from crm.models import Customer, Deal
+
+
+class Command(BaseCommand):
+    help = "Recompute deal_count, deal_total and last_deal_at on customers from their deals."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        fixed = 0
+
+        while True:
+            with transaction.atomic():
+                # Locking the batch makes concurrent deal signals wait for
+                # the recomputed values instead of being overwritten.
+                customers = list(
+                    Customer.objects.select_for_update()
+                    .filter(pk__gt=last_id).order_by('pk')
+                    .only('user_id', 'deal_count', 'deal_total', 'last_deal_at')[:batch_size]
+                )
+                if not customers:
+                    break
+
+                totals = {
+                    row['customer_id']: row
+                    for row in Deal.objects.filter(customer_id__in=[customer.pk for customer in customers])
+                    .values('customer_id')
+                    .annotate(count=Count('id'), total=Sum('amount'), latest=Max('created_at'))
+                }
+
+                changed = []
+                now = timezone.now()
+                for customer in customers:
+                    row = totals.get(customer.pk, {'count': 0, 'total': 0, 'latest': None})
+                    values = (row['count'], row['total'], row['latest'])
+                    if (customer.deal_count, customer.deal_total, customer.last_deal_at) != values:
+                        customer.deal_count, customer.deal_total, customer.last_deal_at = values
+                        customer.updated_at = now
+                        changed.append(customer)
+
+                Customer.objects.bulk_update(changed, ['deal_count', 'deal_total', 'last_deal_at', 'updated_at'])
+
+            for user_id in {customer.user_id for customer in changed}:
+                bump_list_version(user_id)
+                publish_customer_event(user_id, REFRESH)
+
+            fixed += len(changed)
+            last_id = customers[-1].pk
+
+        self.stdout.write(f"Rebuilt deal aggregates, {fixed} customers corrected.")
@@ -0,0 +1,71 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+from crm.models import Customer, Deal, DealDailyRollup, RollupCheckpoint
+from crm.rollups import ROLLUP_NAME
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily deal rollups from the deals behind the rollup high-water mark."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        fixed = 0
+
+        while True:
+            with transaction.atomic():
+                # Holding the checkpoint keeps roll_up_deals and the deal
+                # signals from moving the rollups while a batch is compared.
+                checkpoint, _ = RollupCheckpoint.objects.select_for_update().get_or_create(name=ROLLUP_NAME)
+                customers = dict(
+                    Customer.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', 'user_id')[:batch_size]
+                )
+                if not customers:
+                    break
+
+                expected = {}
+                if checkpoint.last_created_at is not None:
+                    deals = Deal.objects.filter(customer_id__in=customers).filter(
+                        Q(created_at__lt=checkpoint.last_created_at)
+                        | Q(created_at=checkpoint.last_created_at, id__lte=checkpoint.last_id)
+                    )
+                    expected = {
+                        (row['customer_id'], row['day']): (row['count'], row['total'])
+                        for row in deals.annotate(day=TruncDate('created_at'))
+                        .values('customer_id', 'day')
+                        .annotate(count=Count('id'), total=Sum('amount'))
+                    }
+
+                existing = {
+                    (row.customer_id, row.day): row
+                    for row in DealDailyRollup.objects.select_for_update().filter(customer_id__in=customers)
+                }
+
+                created, changed = [], []
+                for (customer_id, day), (count, total) in expected.items():
+                    if (customer_id, day) not in existing:
+                        created.append(DealDailyRollup(
+                            user_id=customers[customer_id], customer_id=customer_id, day=day,
+                            deal_count=count, deal_total=total,
+                        ))
+                for key, row in existing.items():
+                    # Days left without deals keep their row, at zero, as adjust_rollup does.
+                    values = expected.get(key, (0, Decimal('0')))
+                    if (row.deal_count, row.deal_total) != values:
+                        row.deal_count, row.deal_total = values
+                        changed.append(row)
+
+                DealDailyRollup.objects.bulk_create(created)
+                DealDailyRollup.objects.bulk_update(changed, ['deal_count', 'deal_total'])
+
+            fixed += len(created) + len(changed)
+            last_id = max(customers)
+
+        self.stdout.write(f"Rebuilt deal rollups, {fixed} rows corrected.")
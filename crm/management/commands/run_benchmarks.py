@@ -0,0 +1,95 @@
+import json
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crm.benchmarks import BENCH_PASSWORD, SCENARIOS, HttpClient, bench_user, compare, run_scenario
+
+
+class Command(BaseCommand):
+    help = (
+        "Run latency and throughput benchmarks over HTTP against a running server, as tenants created by "
+        "seed_benchmark_data, and write the results as JSON. Fails when any request errors; with --compare, "
+        "also when p95/p99 or throughput regress. The login and signup scenarios need the server started "
+        "with RATE_LIMITS_ENABLED=0."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"Any of: {', '.join(SCENARIOS)}. Defaults to all.")
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help="Server to benchmark.")
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--tenant', type=int, default=1, help="Number of the bench user to run as.")
+        parser.add_argument('--output', help="Write results to this JSON file.")
+        parser.add_argument('--compare', help="Baseline JSON file from an earlier run.")
+        parser.add_argument('--threshold', type=float, default=0.1, help="Allowed regression, as a fraction.")
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}.")
+
+        user = bench_user(options['tenant'])
+        client = HttpClient(options['base_url'])
+        try:
+            if not client.log_in(user.email, BENCH_PASSWORD):
+                raise CommandError(f"Could not log in to {options['base_url']} as {user.email}.")
+        except OSError as e:
+            raise CommandError(f"Could not reach {options['base_url']}: {e}")
+        finally:
+            client.close()
+
+        results = {
+            'started_at': timezone.now().isoformat(),
+            'git_sha': _git_sha(),
+            'settings': {
+                'base_url': options['base_url'],
+                'db_vendor': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+                'db_conn_mode': getattr(settings, 'DB_CONN_MODE', None),
+                'replicas': len(getattr(settings, 'DATABASE_REPLICAS', [])),
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+            },
+            'scenarios': {},
+        }
+
+        for name in names:
+            summary = run_scenario(
+                SCENARIOS[name](user), options['base_url'], options['requests'], options['concurrency'], client.cookies,
+            )
+            results['scenarios'][name] = summary
+            self.stdout.write(
+                f"{name}: p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms p99={summary['p99_ms']}ms "
+                f"rps={summary['throughput_rps']} errors={summary['errors']}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+
+        # Latencies of error responses say nothing about the views.
+        failed = [name for name, summary in results['scenarios'].items() if summary['errors']]
+        if failed:
+            raise CommandError(f"Requests failed in: {', '.join(failed)}.")
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = compare(baseline, results, options['threshold'])
+            for name, metric, before, after, change in regressions:
+                self.stderr.write(f"{name} {metric}: {before} -> {after} ({change:+.1%})")
+            if regressions:
+                sys.exit(1)
+
+
+def _git_sha():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks import SEED_BATCH_SIZE, delete_bench_tenants, seed_tenants
+
+
+class Command(BaseCommand):
+    help = (
+        "Create synthetic benchmark tenants (bench1@example.com, bench2@example.com, ...) with customers "
+        "and deals. Re-running tops up missing customers; --reset removes every bench tenant first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--customers-per-user', type=int, default=100000)
+        parser.add_argument('--deals-per-customer', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE)
+        parser.add_argument('--reset', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            delete_bench_tenants()
+            self.stdout.write("Removed existing benchmark tenants.")
+
+        seed_tenants(
+            options['users'],
+            options['customers_per_user'],
+            options['deals_per_customer'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write,
+        )
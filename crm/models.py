@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 from custom_auth.models import User
 
@@ -8,15 +9,91 @@ class Customer(models.Model):
     email = models.EmailField(unique=True)
     phone = models.CharField(max_length=15)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Delta sync (crm.changes) pages on this. QuerySet.update() and bulk
+    # writes bypass auto_now, so those paths set it themselves.
+    updated_at = models.DateTimeField(auto_now=True)
+    # Maintained from Deal signals (crm.signals); rebuild_deal_aggregates
+    # reconciles them.
+    deal_count = models.PositiveIntegerField(default=0)
+    deal_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    last_deal_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='crm_customer_user_created_idx'),
+            models.Index(fields=['user', '-deal_total', '-id'], name='crm_customer_user_revenue_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='crm_customer_user_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+class CustomerTombstone(models.Model):
+    # Left behind by every customer deletion so delta sync can report it.
+    # Purged after crm.changes.TOMBSTONE_RETENTION.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='customer_tombstones')
+    customer_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'], name='crm_tombstone_user_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} {self.deleted_at}"
+
 class Deal(models.Model):
     title = models.CharField(max_length=255)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="deals")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the customer aggregates currently include, so an
+        # update can apply the difference.
+        instance._loaded_customer_id = instance.__dict__.get('customer_id')
+        instance._loaded_amount = instance.__dict__.get('amount')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # post_save runs after Django's own save transaction; the rollup
+        # adjustment in crm.signals must share one with the write.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return self.title
+
+class DealDailyRollup(models.Model):
+    # Deals per customer per day, maintained by crm.rollups. Dashboards read
+    # these rows instead of grouping raw deals; rebuild_deal_rollups
+    # reconciles them.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='deal_rollups')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='deal_rollups')
+    day = models.DateField()
+    deal_count = models.PositiveIntegerField(default=0)
+    deal_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'day'], name='crm_rollup_customer_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'day'], name='crm_rollup_user_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} {self.day}"
+
+class RollupCheckpoint(models.Model):
+    # High-water mark of the last deal folded into the rollups, as
+    # (created_at, id) so deals sharing a timestamp are not skipped.
+    name = models.CharField(max_length=64, unique=True)
+    last_created_at = models.DateTimeField(blank=True, null=True)
+    last_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
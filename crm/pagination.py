@@ -0,0 +1,140 @@
+import base64
+import binascii
+import datetime
+import json
+import operator
+
+from decimal import Decimal
+from functools import reduce
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps({'d': direction, 'v': [_encode_value(value) for value in values]})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction, values = payload['d'], payload['v']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise Http404("Invalid cursor.")
+
+    if direction not in (NEXT, PREVIOUS) or not isinstance(values, list):
+        raise Http404("Invalid cursor.")
+    return direction, values
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    # Seeks past the cursor position instead of using OFFSET, so page N costs
+    # the same as page 1. The last ordering field must be unique (usually id).
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    def page(self, cursor=None):
+        queryset, backwards = self._page_queryset(cursor)
+        rows = list(queryset)
+        return self._build_page(rows, len(rows) > self.per_page, backwards, from_cursor=bool(cursor))
+
+    async def apage(self, cursor=None):
+        queryset, backwards = self._page_queryset(cursor)
+        rows = [obj async for obj in queryset]
+        return self._build_page(rows, len(rows) > self.per_page, backwards, from_cursor=bool(cursor))
+
+    def _page_queryset(self, cursor):
+        if not cursor:
+            return self.queryset.order_by(*self.ordering)[:self.per_page + 1], False
+
+        direction, values = decode_cursor(cursor)
+        backwards = direction == PREVIOUS
+        position = self._parse_values(values)
+
+        ordering = self._reversed_ordering() if backwards else self.ordering
+        queryset = self.queryset.filter(self._seek_filter(position, backwards)).order_by(*ordering)
+        return queryset[:self.per_page + 1], backwards
+
+    def _build_page(self, rows, has_more, backwards, from_cursor):
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows)
+
+        next_cursor = previous_cursor = None
+        if (has_more and not backwards) or (backwards and from_cursor):
+            next_cursor = encode_cursor(NEXT, self._position(rows[-1]))
+        if (has_more and backwards) or (from_cursor and not backwards):
+            previous_cursor = encode_cursor(PREVIOUS, self._position(rows[0]))
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def _position(self, obj):
+        return [getattr(obj, name) for name in self.fields]
+
+    def _parse_values(self, values):
+        if len(values) != len(self.fields):
+            raise Http404("Invalid cursor.")
+
+        model_meta = self.queryset.model._meta
+        try:
+            return [model_meta.get_field(name).to_python(value) for name, value in zip(self.fields, values)]
+        except ValidationError:
+            raise Http404("Invalid cursor.")
+
+    def _reversed_ordering(self):
+        return tuple(name if desc else f'-{name}' for name, desc in zip(self.fields, self.descending))
+
+    def _seek_filter(self, position, backwards):
+        # (a, b) after (x, y) expands to: a > x OR (a = x AND b > y)
+        terms = []
+        for index, (name, value) in enumerate(zip(self.fields, position)):
+            forward_lookup = 'lt' if self.descending[index] else 'gt'
+            if backwards:
+                forward_lookup = 'gt' if forward_lookup == 'lt' else 'lt'
+            term = Q(**{f'{name}__{forward_lookup}': value})
+            for prev_name, prev_value in zip(self.fields[:index], position[:index]):
+                term &= Q(**{prev_name: prev_value})
+            terms.append(term)
+        return reduce(operator.or_, terms)
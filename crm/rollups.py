@@ -0,0 +1,141 @@
+import datetime
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Customer, Deal, DealDailyRollup, RollupCheckpoint
+
+ROLLUP_NAME = 'deal_daily'
+ROLLUP_BATCH_SIZE = 5000
+# Deals younger than this are left for the next run, so a transaction that
+# commits a little after its created_at is still picked up.
+ROLLUP_LAG = datetime.timedelta(seconds=60)
+GRANULARITIES = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def roll_up_deals(batch_size=ROLLUP_BATCH_SIZE, now=None):
+    # Folds the next batch of deals past the high-water mark into the daily
+    # rollups and advances the mark. Returns the number of deals processed.
+    cutoff = (now or timezone.now()) - ROLLUP_LAG
+
+    with transaction.atomic():
+        checkpoint, _ = RollupCheckpoint.objects.select_for_update().get_or_create(name=ROLLUP_NAME)
+
+        deals = Deal.objects.filter(created_at__lt=cutoff)
+        if checkpoint.last_created_at is not None:
+            deals = deals.filter(
+                Q(created_at__gt=checkpoint.last_created_at)
+                | Q(created_at=checkpoint.last_created_at, id__gt=checkpoint.last_id)
+            )
+        deals = list(
+            deals.order_by('created_at', 'id')
+            .values('id', 'created_at', 'amount', 'customer_id', 'customer__user_id')[:batch_size]
+        )
+        if not deals:
+            return 0
+
+        buckets = defaultdict(lambda: [0, Decimal('0')])
+        owners = {}
+        for deal in deals:
+            key = (deal['customer_id'], timezone.localdate(deal['created_at']))
+            buckets[key][0] += 1
+            buckets[key][1] += deal['amount']
+            owners[deal['customer_id']] = deal['customer__user_id']
+
+        existing = {
+            (row.customer_id, row.day): row
+            for row in DealDailyRollup.objects.select_for_update().filter(
+                customer_id__in=owners, day__in={day for _, day in buckets}
+            )
+        }
+
+        created, updated = [], []
+        for (customer_id, day), (count, total) in buckets.items():
+            row = existing.get((customer_id, day))
+            if row is None:
+                created.append(DealDailyRollup(
+                    user_id=owners[customer_id], customer_id=customer_id, day=day, deal_count=count, deal_total=total,
+                ))
+            else:
+                row.deal_count += count
+                row.deal_total += total
+                updated.append(row)
+
+        DealDailyRollup.objects.bulk_create(created)
+        DealDailyRollup.objects.bulk_update(updated, ['deal_count', 'deal_total'])
+
+        checkpoint.last_created_at = deals[-1]['created_at']
+        checkpoint.last_id = deals[-1]['id']
+        checkpoint.save(update_fields=['last_created_at', 'last_id'])
+
+    return len(deals)
+
+
+def is_rolled_up(deal):
+    # Locks the checkpoint until the caller's transaction ends, the one that
+    # wrote the deal: roll_up_deals either folded the deal in before (and the
+    # caller adjusts) or waits and reads the committed deal afterwards.
+    checkpoint = (
+        RollupCheckpoint.objects.select_for_update()
+        .filter(name=ROLLUP_NAME).values_list('last_created_at', 'last_id').first()
+    )
+    if not checkpoint or checkpoint[0] is None:
+        return False
+    return (deal.created_at, deal.pk) <= checkpoint
+
+
+def adjust_rollup(customer_id, created_at, count, amount):
+    # Keeps rollups right when a deal behind the high-water mark is changed
+    # or deleted; new deals are picked up by roll_up_deals.
+    day = timezone.localdate(created_at)
+    updated = DealDailyRollup.objects.filter(customer_id=customer_id, day=day).update(
+        deal_count=F('deal_count') + count,
+        deal_total=F('deal_total') + amount,
+    )
+    if not updated and count > 0:
+        user_id = Customer.objects.filter(pk=customer_id).values_list('user_id', flat=True).first()
+        DealDailyRollup.objects.create(user_id=user_id, customer_id=customer_id, day=day, deal_count=count, deal_total=amount)
+
+
+def deal_analytics(user, start, end, granularity='day', top=5):
+    rollups = DealDailyRollup.objects.filter(user=user, day__gte=start, day__lte=end)
+
+    trunc = GRANULARITIES[granularity]
+    bucketed = rollups.annotate(bucket=trunc('day')) if trunc else rollups.annotate(bucket=F('day'))
+    series = (
+        bucketed.values('bucket')
+        .annotate(deal_count=Sum('deal_count'), deal_total=Sum('deal_total'))
+        .order_by('bucket')
+    )
+    top_customers = (
+        rollups.values('customer_id', 'customer__name')
+        .annotate(deal_count=Sum('deal_count'), deal_total=Sum('deal_total'))
+        .order_by('-deal_total', 'customer_id')[:top]
+    )
+
+    return {
+        'start': start,
+        'end': end,
+        'granularity': granularity,
+        'series': [
+            {'bucket': row['bucket'], 'deal_count': row['deal_count'], 'deal_total': row['deal_total']}
+            for row in series
+        ],
+        'top_customers': [
+            {
+                'id': row['customer_id'],
+                'name': row['customer__name'],
+                'deal_count': row['deal_count'],
+                'deal_total': row['deal_total'],
+            }
+            for row in top_customers
+        ],
+    }
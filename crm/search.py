@@ -0,0 +1,80 @@
+import re
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Upper
+
+from .models import Customer
+
+SEARCH_CONFIG = 'simple'
+SEARCH_LIMIT = 50
+
+# PostgreSQL-only indexes. They are created by create_search_indexes() after
+# migrate instead of Customer.Meta.indexes so that SQLite keeps working.
+SEARCH_INDEXES = [
+    GinIndex(
+        SearchVector('name', 'email', 'phone', config=SEARCH_CONFIG),
+        name='crm_customer_search_idx',
+    ),
+    GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='crm_customer_name_trgm_idx'),
+    GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'), name='crm_customer_email_trgm_idx'),
+    GinIndex(OpClass('phone', name='gin_trgm_ops'), name='crm_customer_phone_trgm_idx'),
+]
+
+
+def search_customers(queryset, query, limit=SEARCH_LIMIT):
+    query = query.strip()
+    if not query:
+        return queryset.none()
+
+    if connections[queryset.db].vendor == 'postgresql':
+        results = _postgres_search(queryset, query)
+    else:
+        results = _fallback_search(queryset, query)
+
+    return results[:limit] if limit else results
+
+
+def _postgres_search(queryset, query):
+    condition = Q(name__icontains=query) | Q(email__icontains=query) | Q(phone__contains=query)
+    rank = TrigramSimilarity('name', query) + TrigramSimilarity('email', query)
+
+    # Every word becomes a prefix match so results show up while typing.
+    terms = re.findall(r'\w+', query)
+    if terms:
+        tsquery = SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config=SEARCH_CONFIG)
+        queryset = queryset.annotate(search=SearchVector('name', 'email', 'phone', config=SEARCH_CONFIG))
+        condition |= Q(search=tsquery)
+        rank = rank + SearchRank(F('search'), tsquery)
+
+    return queryset.filter(condition).annotate(rank=rank).order_by('-rank', '-id')
+
+
+def _fallback_search(queryset, query):
+    return queryset.filter(
+        Q(name__icontains=query) | Q(email__icontains=query) | Q(phone__contains=query)
+    ).annotate(
+        rank=Case(
+            When(name__istartswith=query, then=Value(3)),
+            When(Q(email__istartswith=query) | Q(phone__startswith=query), then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    ).order_by('-rank', 'name', '-id')
+
+
+def create_search_indexes(using=DEFAULT_DB_ALIAS, **kwargs):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        existing = connection.introspection.get_constraints(cursor, Customer._meta.db_table)
+
+    with connection.schema_editor() as schema_editor:
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for index in SEARCH_INDEXES:
+            if index.name not in existing:
+                schema_editor.add_index(Customer, index)
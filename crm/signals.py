@@ -0,0 +1,111 @@
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from custom_auth.models import User
+
+from .caching import bump_list_version
+from .events import CREATED, DELETED, UPDATED, publish_customer_event
+from .models import Customer, CustomerTombstone, Deal
+from .rollups import adjust_rollup, is_rolled_up
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_customer_list(sender, instance, **kwargs):
+    bump_list_version(instance.user_id)
+
+
+@receiver(post_save, sender=Customer)
+def publish_customer_saved(sender, instance, created, **kwargs):
+    publish_customer_event(instance.user_id, CREATED if created else UPDATED, instance.pk)
+
+
+@receiver(post_delete, sender=Customer)
+def publish_customer_deleted(sender, instance, **kwargs):
+    publish_customer_event(instance.user_id, DELETED, instance.pk)
+
+
+@receiver(post_delete, sender=Customer)
+def record_customer_tombstone(sender, instance, origin=None, **kwargs):
+    # Nobody is left to sync when the whole account goes.
+    if _deleted_with(origin, User):
+        return
+    CustomerTombstone.objects.create(user_id=instance.user_id, customer_id=instance.pk)
+
+
+@receiver(post_save, sender=Deal)
+def add_deal_to_aggregates(sender, instance, created, **kwargs):
+    loaded_customer_id = getattr(instance, '_loaded_customer_id', None)
+    loaded_amount = getattr(instance, '_loaded_amount', None)
+
+    if created:
+        _apply_deal(instance.customer_id, 1, instance.amount, instance.created_at)
+    elif loaded_customer_id is None or loaded_amount is None:
+        # Not loaded from the database (or amount deferred): nothing to diff
+        # against, rebuild_deal_aggregates will reconcile.
+        return
+    elif loaded_customer_id != instance.customer_id:
+        _remove_deal(loaded_customer_id, loaded_amount)
+        _apply_deal(instance.customer_id, 1, instance.amount, instance.created_at)
+        if is_rolled_up(instance):
+            adjust_rollup(loaded_customer_id, instance.created_at, -1, -loaded_amount)
+            adjust_rollup(instance.customer_id, instance.created_at, 1, instance.amount)
+    elif loaded_amount != instance.amount:
+        _apply_deal(instance.customer_id, 0, instance.amount - loaded_amount, instance.created_at)
+        if is_rolled_up(instance):
+            adjust_rollup(instance.customer_id, instance.created_at, 0, instance.amount - loaded_amount)
+    else:
+        return
+
+    instance._loaded_customer_id = instance.customer_id
+    instance._loaded_amount = instance.amount
+
+
+@receiver(post_delete, sender=Deal)
+def remove_deal_from_aggregates(sender, instance, origin=None, **kwargs):
+    # Deals cascading from their customer or account take the aggregates
+    # with them; updating a row that is being deleted would only cost
+    # queries per deal and trip the deal_count check if it was stale.
+    if _deleted_with(origin, Customer, User):
+        return
+    _remove_deal(instance.customer_id, instance.amount)
+    if is_rolled_up(instance):
+        adjust_rollup(instance.customer_id, instance.created_at, -1, -instance.amount)
+
+
+def _deleted_with(origin, *models):
+    # origin is the instance or queryset delete() was called on.
+    return getattr(origin, 'model', type(origin)) in models
+
+
+def _apply_deal(customer_id, count, amount, created_at):
+    # Single UPDATE with F() so concurrent deal writes never lose an increment.
+    Customer.objects.filter(pk=customer_id).update(
+        deal_count=F('deal_count') + count,
+        deal_total=F('deal_total') + amount,
+        last_deal_at=Greatest(Coalesce('last_deal_at', Value(created_at)), Value(created_at)),
+        updated_at=timezone.now(),
+    )
+    _bump_owner(customer_id)
+
+
+def _remove_deal(customer_id, amount):
+    latest = Deal.objects.filter(customer=OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+    Customer.objects.filter(pk=customer_id).update(
+        deal_count=F('deal_count') - 1,
+        deal_total=F('deal_total') - amount,
+        last_deal_at=Subquery(latest),
+        updated_at=timezone.now(),
+    )
+    _bump_owner(customer_id)
+
+
+def _bump_owner(customer_id):
+    # QuerySet.update() sends no post_save, but the list shows the aggregates.
+    user_id = Customer.objects.filter(pk=customer_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        bump_list_version(user_id)
+        publish_customer_event(user_id, UPDATED, customer_id)
@@ -1,17 +1,46 @@
+import asyncio
+import csv
+import datetime
+import gzip
 import json
+import os
+import tempfile
 
+from asgiref.sync import sync_to_async
+from decimal import Decimal
+from io import StringIO
 from django.urls import reverse
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, LiveServerTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.contrib.messages import get_messages
+from django.utils import timezone
 from unittest.mock import patch
-
-from .models import Customer
+from crm_project_vacancy.metrics import Registry
+from crm_project_vacancy.query_budget import QueryBudgetExceeded
+from crm_project_vacancy.routers import PrimaryReplicaRouter, is_sticky, replica_reads
+from custom_auth.models import ApiToken
+from custom_auth.ratelimit import rate_limiter
+
+from .caching import cache_stats
+from .celery_tasks import delete_customers_job
+from .changes import TOMBSTONE_RETENTION, purge_tombstones
+from .deletion import delete_customers
+from .events import customer_events
+from .pagination import NEXT, encode_cursor
+from .models import Customer, CustomerTombstone, Deal, DealDailyRollup
+from .rollups import roll_up_deals
+from .views import CustomerEventStreamView, CustomerListView, DealListView
 
 class CustomerViewsTests(TestCase):
 
     def setUp(self):
 
+        cache.clear()
         self.user_model = get_user_model()
         self.user = self.user_model.objects.create(
             email="testuser@example.com",
@@ -68,6 +97,519 @@ class CustomerViewsTests(TestCase):
 
         self.assertRedirects(response, reverse("auth:login"))
 
+    @patch.object(CustomerListView, "page_size", 2)
+    def test_customer_list_cursor_pagination(self):
+
+        for i in range(4):
+            Customer.objects.create(user=self.user, name=f"Customer {i}", email=f"customer{i}@example.com")
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        first_page = self.client.get(self.url)
+        self.assertEqual([c.name for c in first_page.context['customers']], ["Customer 3", "Customer 2"])
+        self.assertFalse(first_page.context['page_obj'].has_previous())
+
+        second_page = self.client.get(self.url, {'cursor': first_page.context['page_obj'].next_cursor})
+        self.assertEqual([c.name for c in second_page.context['customers']], ["Customer 1", "Customer 0"])
+
+        last_page = self.client.get(self.url, {'cursor': second_page.context['page_obj'].next_cursor})
+        self.assertEqual([c.name for c in last_page.context['customers']], ["Test Customer"])
+        self.assertFalse(last_page.context['page_obj'].has_next())
+
+        back_page = self.client.get(self.url, {'cursor': last_page.context['page_obj'].previous_cursor})
+        self.assertEqual([c.name for c in back_page.context['customers']], ["Customer 1", "Customer 0"])
+
+    def test_customer_list_invalid_cursor(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_customer_list_search(self):
+
+        Customer.objects.create(user=self.user, name="Alice Johnson", email="alice@example.com", phone="5551234")
+        Customer.objects.create(user=self.user, name="Bob Stone", email="bob@example.com", phone="5559876")
+        Customer.objects.create(user=self.user2, name="Alice Other", email="alice.other@example.com", phone="5550000")
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        cases = [("alice", ["Alice Johnson"]), ("bob@", ["Bob Stone"]), ("555", ["Alice Johnson", "Bob Stone"])]
+        for query, expected in cases:
+            with self.subTest(query=query):
+                response = self.client.get(self.url, {'q': query})
+                self.assertCountEqual([c.name for c in response.context['customers']], expected)
+
+    def test_customer_list_search_htmx_partial(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.get(self.url, {'q': "Test"}, HTTP_HX_REQUEST="true")
+
+        self.assertTemplateUsed(response, 'crm/customer_table.html')
+        self.assertTemplateNotUsed(response, 'crm/customer_list.html')
+        self.assertContains(response, "Test Customer")
+
+    def test_import_customers_csv_upload(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        Customer.objects.create(user=self.user2, name="Foreign", email="foreign@example.com", phone="111")
+        content = (
+            "name,email,phone\n"
+            "New Customer,new@example.com,12345\n"
+            "Renamed Customer,customer@example.com,67890\n"
+            "Bad Phone,badphone@example.com,abc\n"
+            "Foreign,foreign@example.com,222\n"
+        )
+        upload = SimpleUploadedFile("customers.csv", content.encode(), content_type="text/csv")
+
+        response = self.client.post(reverse("crm:customer_import"), {"file": upload})
+
+        self.assertEqual(response.status_code, 200)
+        report = response.context["report"]
+        self.assertEqual((report.processed, report.imported, report.failed), (4, 2, 2))
+        self.assertEqual([error["line"] for error in report.errors], [4, 5])
+
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.name, self.customer.phone), ("Renamed Customer", "67890"))
+        self.assertTrue(Customer.objects.filter(user=self.user, email="new@example.com").exists())
+        self.assertFalse(Customer.objects.filter(user=self.user, email="badphone@example.com").exists())
+        self.assertEqual(Customer.objects.get(email="foreign@example.com").user, self.user2)
+
+    def test_import_reports_unreadable_files(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        latin1 = "name,email,phone\nFirst,first@example.com,1\nJos\xe9,jose@example.com,2\n".encode("latin-1")
+        response = self.client.post(reverse("crm:customer_import"), {"file": SimpleUploadedFile("a.csv", latin1)})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("not valid UTF-8", response.context["report"].errors[0]["errors"][0])
+
+        broken = b"name,email,phone\nSecond,second@example.com,1\n" + b"x" * (csv.field_size_limit() + 1) + b",a@example.com,2\n"
+        response = self.client.post(reverse("crm:customer_import"), {"file": SimpleUploadedFile("b.csv", broken)})
+        report = response.context["report"]
+        self.assertEqual((report.imported, report.failed), (1, 1))
+        self.assertIn("Malformed CSV", report.errors[0]["errors"][0])
+        self.assertTrue(Customer.objects.filter(user=self.user, email="second@example.com").exists())
+
+    def test_import_customers_command_jsonl(self):
+
+        rows = [
+            {"name": "One", "email": "one@example.com", "phone": "1"},
+            {"name": "Two", "email": "two@example.com", "phone": "2"},
+            {"name": "Three", "email": "three@example.com", "phone": "3"},
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.write("\n".join(json.dumps(row) for row in rows) + "\nnot json\n")
+        self.addCleanup(os.remove, f.name)
+
+        out, err = StringIO(), StringIO()
+        call_command("import_customers", f.name, user=self.user.email, batch_size=2, stdout=out, stderr=err)
+
+        self.assertEqual(Customer.objects.filter(user=self.user).count(), 4)
+        self.assertIn("3 imported, 1 failed", out.getvalue())
+        self.assertIn("Line 4: Invalid JSON", err.getvalue())
+
+    def test_export_customers_csv(self):
+
+        Customer.objects.create(user=self.user2, name="Foreign", email="foreign@example.com", phone="111")
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.get(reverse("crm:customer_export"), {"format": "csv"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="customers.csv"')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,name,email,phone,created_at")
+        self.assertEqual(len(lines), 2)
+        self.assertIn("customer@example.com", lines[1])
+
+    def test_export_customers_jsonl_gzip(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.get(reverse("crm:customer_export"), {"format": "ndjson", "gzip": "1"})
+
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        records = [json.loads(line) for line in gzip.decompress(b"".join(response.streaming_content)).splitlines()]
+        self.assertEqual([record["email"] for record in records], ["customer@example.com"])
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+
+        await self.async_client.aforce_login(self.user)
+
+        with override_settings(DATABASE_REPLICAS=['default']):
+            response = await self.async_client.get(reverse("crm:customer_export"), {"format": "csv"})
+            self.assertTrue(response.is_async)
+            lines = b"".join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+
+        self.assertEqual(lines[0], "id,name,email,phone,created_at")
+        self.assertEqual(len(lines), 2)
+
+    def test_customer_list_cache_invalidation(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        self.client.get(self.url)
+        before = cache_stats()
+        response = self.client.get(self.url)
+        after = cache_stats()
+        self.assertContains(response, "Test Customer")
+        self.assertEqual(after['misses'], before['misses'])
+        self.assertGreater(after['hits'], before['hits'])
+
+        Customer.objects.create(user=self.user, name="Fresh Customer", email="fresh@example.com")
+        self.assertContains(self.client.get(self.url), "Fresh Customer")
+
+        self.client.post(self.url, json.dumps({"ids": [self.customer.id]}), content_type='application/json')
+        self.assertNotContains(self.client.get(self.url), "Test Customer")
+
+    def test_htmx_create_customer_returns_row_and_count(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.post(
+            reverse("crm:customer_create"),
+            {"name": "Htmx Customer", "email": "htmx@example.com", "phone": "12345"},
+            HTTP_HX_REQUEST="true",
+        )
+
+        customer = Customer.objects.get(email="htmx@example.com")
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'crm/customer_create_success.html')
+        self.assertContains(response, f'id="customer-{customer.pk}"')
+        self.assertContains(response, '<span id="customer-count" hx-swap-oob="true">2</span>', html=True)
+        self.assertNotContains(response, "<html")
+
+    def test_htmx_create_customer_invalid_form_retargets(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.post(reverse("crm:customer_create"), {"name": "John"}, HTTP_HX_REQUEST="true")
+
+        self.assertEqual(response["HX-Retarget"], "#customer-form-slot")
+        self.assertTemplateUsed(response, 'crm/customer_form_fragment.html')
+        self.assertContains(response, "Email: This field is required.")
+
+    def test_htmx_update_customer_returns_row(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.post(self.update_url, {
+            'name': "Inline Edit",
+            'email': "customer@example.com",
+            'phone': "12345"
+        }, HTTP_HX_REQUEST="true")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'crm/customer_row.html')
+        self.assertContains(response, "Inline Edit")
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.name, "Inline Edit")
+
+    def test_last_modified_is_not_guessed_after_eviction(self):
+
+        other = Customer.objects.create(user=self.user, name="Other", email="other@example.com", phone="1")
+        self.client.login(email="testuser@example.com", password="testpassword123")
+        response = self.client.get(self.url)
+        detail = self.client.get(reverse("crm:customer_detail", kwargs={"pk": self.customer.pk}))
+
+        other.delete()
+        cache.clear()
+
+        # Nothing left in the table dates the deletion, so the cached
+        # Last-Modified must not be trusted either way.
+        refreshed = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertFalse(refreshed.has_header("Last-Modified"))
+        self.assertNotContains(refreshed, "other@example.com")
+        refreshed = self.client.get(
+            reverse("crm:customer_detail", kwargs={"pk": self.customer.pk}), HTTP_IF_MODIFIED_SINCE=detail["Last-Modified"],
+        )
+        self.assertEqual(refreshed.status_code, 200)
+
+        self.assertTrue(self.client.get(self.url).has_header("Last-Modified"))
+
+    def test_htmx_delete_customer_returns_count_only(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.delete(self.delete_url, HTTP_HX_REQUEST="true")
+
+        self.assertContains(response, '<span id="customer-count" hx-swap-oob="true">0</span>', html=True)
+        self.assertFalse(Customer.objects.filter(pk=self.customer.pk).exists())
+
+    def test_customer_list_conditional_get(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header("ETag"))
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+
+        Customer.objects.create(user=self.user, name="Another", email="another@example.com")
+        modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(modified.status_code, 200)
+        self.assertContains(modified, "Another")
+
+    def test_customer_detail_conditional_get(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+        detail_url = reverse('crm:customer_detail', kwargs={'pk': self.customer.pk})
+
+        response = self.client.get(detail_url)
+        not_modified = self.client.get(detail_url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_customer_list_compressed(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        gzipped = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(gzipped["Content-Encoding"], "gzip")
+
+        brotli_response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(brotli_response["Content-Encoding"], "br")
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_read_only_views_use_replica(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        db_for_read = PrimaryReplicaRouter.db_for_read
+        aliases = []
+
+        def record_alias(router, model, **hints):
+            aliases.append(db_for_read(router, model, **hints))
+            return aliases[-1]
+
+        with patch('crm_project_vacancy.routers.random.choice', return_value='default') as choose_replica, \
+                patch.object(PrimaryReplicaRouter, 'db_for_read', record_alias):
+            self.client.get(self.url)
+            # One replica for the count and the page query.
+            self.assertEqual(choose_replica.call_count, 1)
+            self.assertIn('default', aliases)
+
+            choose_replica.reset_mock()
+            response = self.client.get(reverse("crm:customer_export"), {"format": "csv"})
+            aliases.clear()
+            b"".join(response.streaming_content)
+        # Rows are fetched while the body streams, after the view returned,
+        # from the replica the request picked.
+        self.assertEqual(choose_replica.call_count, 1)
+        self.assertEqual(set(aliases), {'default'})
+
+    async def test_customer_api_list_and_detail(self):
+
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(reverse("crm:customer_list_api"), {"sort": "revenue"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([customer["id"] for customer in response.json()["customers"]], [self.customer.pk])
+
+        response = await self.async_client.get(reverse("crm:customer_detail_api", kwargs={"pk": self.customer.pk}))
+        self.assertEqual(response.json()["customer"]["email"], "customer@example.com")
+
+    async def test_customer_api_detail_not_owner(self):
+
+        await self.async_client.aforce_login(self.user2)
+
+        response = await self.async_client.get(reverse("crm:customer_detail_api", kwargs={"pk": self.customer.pk}))
+
+        self.assertEqual(response.status_code, 404)
+
+    async def test_customer_api_search(self):
+
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(reverse("crm:customer_search_api"), {"q": "Test"})
+        self.assertEqual([customer["name"] for customer in response.json()["customers"]], ["Test Customer"])
+
+        response = await self.async_client.get(reverse("crm:customer_search_api"))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_customer_api_requires_verified_email(self):
+
+        await self.async_client.aforce_login(self.anonymous_user)
+
+        response = await self.async_client.get(reverse("crm:customer_list_api"))
+
+        self.assertEqual(response.status_code, 403)
+
+    def create_live_customer(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Customer.objects.create(user=self.user, name="Live", email="live@example.com", phone="1")
+
+    async def test_customer_events_reach_only_the_owner(self):
+
+        view = CustomerEventStreamView()
+        stream, other = view.stream(self.user.pk), view.stream(self.user2.pk)
+        self.assertEqual(await anext(stream), "retry: 5000\n\n")
+        await anext(other)
+
+        customer = await sync_to_async(self.create_live_customer)()
+
+        with self.settings(CUSTOMER_EVENTS_KEEPALIVE=0.05):
+            event = await asyncio.wait_for(anext(stream), 1)
+            self.assertEqual(event, f'event: customer\ndata: {{"action": "created", "id": {customer.pk}}}\n\n')
+            self.assertEqual(await asyncio.wait_for(anext(other), 1), ": keepalive\n\n")
+
+        await stream.aclose()
+        await other.aclose()
+        self.assertEqual(dict(customer_events._subscribers), {})
+
+    def test_customer_events_need_an_asgi_server(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        self.assertEqual(self.client.get(reverse("crm:customer_events")).status_code, 204)
+        self.assertNotContains(self.client.get(self.url), "new EventSource")
+
+    async def test_customer_list_opens_event_stream_under_asgi(self):
+
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(self.url)
+
+        self.assertContains(response, "new EventSource")
+
+    async def test_customer_event_stream_is_not_compressed(self):
+
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(reverse("crm:customer_events"), HTTP_ACCEPT_ENCODING="gzip, br")
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def change_customers(self):
+        first = Customer.objects.create(user=self.user, name="First", email="first@example.com", phone="1")
+        second = Customer.objects.create(user=self.user, name="Second", email="second@example.com", phone="2")
+        self.customer.name = "Renamed"
+        self.customer.save()
+        deleted_ids = first.pk, second.pk
+        first.delete()
+        delete_customers(self.user.pk, [second.pk])
+        return deleted_ids
+
+    @patch("crm.changes.CHANGES_SETTLE", datetime.timedelta(0))
+    async def test_customer_changes_api(self):
+
+        await self.async_client.aforce_login(self.user)
+        url = reverse("crm:customer_changes_api")
+
+        initial = (await self.async_client.get(url)).json()
+        self.assertEqual([customer["id"] for customer in initial["customers"]], [self.customer.pk])
+        self.assertEqual((initial["deleted"], initial["has_more"]), ([], False))
+
+        idle = (await self.async_client.get(url, {"cursor": initial["cursor"]})).json()
+        self.assertEqual((idle["customers"], idle["deleted"]), ([], []))
+
+        deleted_ids = await sync_to_async(self.change_customers)()
+
+        cursor, customers, deleted, pages = idle["cursor"], [], [], 0
+        while True:
+            page = (await self.async_client.get(url, {"cursor": cursor, "limit": 1})).json()
+            customers += page["customers"]
+            deleted += page["deleted"]
+            cursor, pages = page["cursor"], pages + 1
+            if not page["has_more"]:
+                break
+
+        self.assertEqual([(customer["id"], customer["name"]) for customer in customers], [(self.customer.pk, "Renamed")])
+        self.assertEqual(sorted(deleted), sorted(deleted_ids))
+        self.assertGreaterEqual(pages, 2)
+
+    async def test_customer_changes_api_rejects_expired_cursor(self):
+
+        await self.async_client.aforce_login(self.user)
+        expired = timezone.now() - TOMBSTONE_RETENTION - datetime.timedelta(days=1)
+
+        response = await self.async_client.get(
+            reverse("crm:customer_changes_api"), {"cursor": encode_cursor(NEXT, [expired.isoformat(), 0, expired.isoformat(), 0])}
+        )
+
+        self.assertEqual(response.status_code, 410)
+
+    def test_customer_tombstones(self):
+
+        customer_id = self.customer.pk
+        self.customer.delete()
+        other = Customer.objects.create(user=self.user2, name="Other", email="other@example.com", phone="1")
+        self.user2.delete()
+
+        self.assertEqual(list(CustomerTombstone.objects.values_list("user_id", "customer_id")), [(self.user.pk, customer_id)])
+        self.assertFalse(CustomerTombstone.objects.filter(customer_id=other.pk).exists())
+        self.assertEqual(purge_tombstones(now=timezone.now() + TOMBSTONE_RETENTION + datetime.timedelta(days=1)), 1)
+
+    def test_bulk_changes_publish_refresh(self):
+
+        with patch("crm.events.customer_events.publish") as publish, self.captureOnCommitCallbacks(execute=True):
+            delete_customers(self.user.pk, [self.customer.pk])
+
+        publish.assert_called_once_with(self.user.pk, {"action": "refresh", "id": None})
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    async def test_customer_api_reads_use_replica(self):
+
+        await self.async_client.aforce_login(self.user)
+
+        with patch('crm_project_vacancy.routers.random.choice', return_value='default') as choose_replica:
+            response = await self.async_client.get(reverse("crm:customer_list_api"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(choose_replica.called)
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_reads_stick_to_primary_after_write(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+        self.client.post(
+            reverse("crm:customer_create"),
+            {"name": "Sticky", "email": "sticky@example.com", "phone": "12345"},
+        )
+        self.assertTrue(is_sticky(self.user.pk))
+        self.assertFalse(is_sticky(self.user2.pk))
+
+        with patch('crm_project_vacancy.routers.random.choice') as choose_replica:
+            response = self.client.get(self.url)
+        self.assertFalse(choose_replica.called)
+        self.assertContains(response, "Sticky")
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_background_writes_stick_to_primary(self):
+
+        other = Customer.objects.create(user=self.user, name="Other", email="other@example.com", phone="1")
+        cache.clear()
+
+        delete_customers_job.delay("job", self.user.pk, [self.customer.pk, other.pk])
+
+        self.assertTrue(is_sticky(self.user.pk))
+        self.client.login(email="testuser@example.com", password="testpassword123")
+        with patch('crm_project_vacancy.routers.random.choice') as choose_replica:
+            response = self.client.get(self.url)
+        self.assertFalse(choose_replica.called)
+        self.assertNotContains(response, "other@example.com")
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_router_only_sends_crm_reads_to_replica(self):
+
+        router = PrimaryReplicaRouter()
+        self.assertIsNone(router.db_for_read(Customer))
+
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Customer), 'replica1')
+            self.assertIsNone(router.db_for_read(self.user_model))
+            self.assertEqual(router.db_for_write(Customer), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'crm'))
+
     def test_delete_customers(self):
 
         self.client.login(email="testuser@example.com", password="testpassword123")
@@ -80,6 +622,330 @@ class CustomerViewsTests(TestCase):
 
         self.assertFalse(Customer.objects.filter(id=self.customer.id).exists())
 
+    def test_delete_customers_removes_deals_in_chunks(self):
+
+        other = Customer.objects.create(user=self.user, name="Other", email="other@example.com", phone="1")
+        foreign = Customer.objects.create(user=self.user2, name="Foreign", email="foreign@example.com", phone="2")
+        Deal.objects.create(title="Deal", customer=self.customer, amount=10)
+        Deal.objects.create(title="Foreign deal", customer=foreign, amount=10)
+        progress = []
+
+        deleted = delete_customers(
+            self.user.pk, [self.customer.pk, other.pk, foreign.pk], chunk_size=2,
+            on_progress=lambda deleted, processed: progress.append((deleted, processed)),
+        )
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(progress, [(2, 2), (2, 3)])
+        self.assertEqual(list(Customer.objects.values_list('pk', flat=True)), [foreign.pk])
+        self.assertEqual(list(Deal.objects.values_list('title', flat=True)), ["Foreign deal"])
+
+    @patch('crm.views.BULK_DELETE_ASYNC_THRESHOLD', 1)
+    def test_large_bulk_delete_runs_as_job(self):
+
+        other = Customer.objects.create(user=self.user, name="Other", email="other@example.com", phone="1")
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        data = json.dumps({"ids": [self.customer.id, other.id]})
+        response = self.client.post(self.url, data, content_type='application/json')
+
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertFalse(Customer.objects.filter(user=self.user).exists())
+
+        status = self.client.get(job['status_url'], HTTP_HX_REQUEST="true")
+        self.assertContains(status, "Deleted 2 clients.")
+        self.assertNotContains(status, 'hx-trigger="every 1s"')
+
+        self.client.login(email="testuser2@example.com", password="testpassword123")
+        self.assertEqual(self.client.get(job['status_url']).status_code, 404)
+
+    def test_deal_aggregates_follow_deal_changes(self):
+
+        other = Customer.objects.create(user=self.user, name="Other", email="other@example.com", phone="1")
+        first = Deal.objects.create(title="First", customer=self.customer, amount=Decimal("100.00"))
+        second = Deal.objects.create(title="Second", customer=self.customer, amount=Decimal("50.00"))
+
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.deal_count, self.customer.deal_total), (2, Decimal("150.00")))
+        self.assertEqual(self.customer.last_deal_at, second.created_at)
+
+        deal = Deal.objects.get(pk=first.pk)
+        deal.amount = Decimal("120.00")
+        deal.save()
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.deal_total, Decimal("170.00"))
+
+        deal.customer = other
+        deal.save()
+        second.delete()
+        self.customer.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.customer.deal_count, self.customer.deal_total, self.customer.last_deal_at), (0, 0, None))
+        self.assertEqual((other.deal_count, other.deal_total), (1, Decimal("120.00")))
+
+    def test_customer_delete_skips_per_deal_aggregate_updates(self):
+
+        def delete_with_deals(count):
+            customer = Customer.objects.create(user=self.user, name="Many", email=f"many{count}@example.com", phone="1")
+            Deal.objects.bulk_create([Deal(title="Deal", customer=customer, amount=Decimal("1.00")) for _ in range(count)])
+            # Stale aggregates: a per-deal decrement would break the check constraint.
+            with CaptureQueriesContext(connection) as queries:
+                customer.delete()
+            return len(queries)
+
+        self.assertEqual(delete_with_deals(2), delete_with_deals(20))
+        self.assertFalse(Deal.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.user.delete()
+        self.assertFalse(any('UPDATE' in query['sql'] for query in queries))
+
+    def test_rebuild_deal_aggregates(self):
+
+        Deal.objects.create(title="Deal", customer=self.customer, amount=Decimal("30.00"))
+        Customer.objects.filter(pk=self.customer.pk).update(deal_count=7, deal_total=0)
+
+        out = StringIO()
+        call_command("rebuild_deal_aggregates", "--batch-size", "1", stdout=out)
+
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.deal_count, self.customer.deal_total), (1, Decimal("30.00")))
+        self.assertIn("1 customers corrected", out.getvalue())
+
+    def test_customer_list_sort_by_revenue(self):
+
+        big = Customer.objects.create(user=self.user, name="Big Spender", email="big@example.com", phone="1")
+        Deal.objects.create(title="Deal", customer=big, amount=Decimal("999.00"))
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.get(self.url, {"sort": "revenue"})
+
+        self.assertEqual([customer.pk for customer in response.context["customers"]], [big.pk, self.customer.pk])
+
+    def test_deal_rollups_advance_from_high_water_mark(self):
+
+        later = timezone.now() + datetime.timedelta(minutes=5)
+        first = Deal.objects.create(title="First", customer=self.customer, amount=Decimal("10.00"))
+        Deal.objects.create(title="Second", customer=self.customer, amount=Decimal("15.00"))
+
+        self.assertEqual(roll_up_deals(now=later), 2)
+        self.assertEqual(roll_up_deals(now=later), 0)
+
+        Deal.objects.create(title="Third", customer=self.customer, amount=Decimal("5.00"))
+        self.assertEqual(roll_up_deals(now=later), 1)
+
+        rollup = DealDailyRollup.objects.get(customer=self.customer)
+        self.assertEqual((rollup.deal_count, rollup.deal_total), (3, Decimal("30.00")))
+
+        first.delete()
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.deal_count, rollup.deal_total), (2, Decimal("20.00")))
+
+    def test_rebuild_deal_rollups(self):
+
+        later = timezone.now() + datetime.timedelta(minutes=5)
+        other = Customer.objects.create(user=self.user, name="Other", email="other@example.com", phone="1")
+        Deal.objects.create(title="First", customer=self.customer, amount=Decimal("10.00"))
+        Deal.objects.create(title="Second", customer=other, amount=Decimal("15.00"))
+        roll_up_deals(now=later)
+        Deal.objects.create(title="Pending", customer=self.customer, amount=Decimal("5.00"))
+
+        DealDailyRollup.objects.filter(customer=self.customer).update(deal_count=7, deal_total=Decimal("1.00"))
+        DealDailyRollup.objects.filter(customer=other).delete()
+        stray = DealDailyRollup.objects.create(
+            user=self.user, customer=other, day=datetime.date(2000, 1, 1), deal_count=2, deal_total=Decimal("3.00"),
+        )
+
+        out = StringIO()
+        call_command("rebuild_deal_rollups", batch_size=1, stdout=out)
+
+        rollup = DealDailyRollup.objects.get(customer=self.customer)
+        self.assertEqual((rollup.deal_count, rollup.deal_total), (1, Decimal("10.00")))
+        rollup = DealDailyRollup.objects.get(customer=other, day=timezone.localdate())
+        self.assertEqual((rollup.deal_count, rollup.deal_total), (1, Decimal("15.00")))
+        stray.refresh_from_db()
+        self.assertEqual((stray.deal_count, stray.deal_total), (0, Decimal("0.00")))
+        self.assertIn("3 rows corrected", out.getvalue())
+
+        self.assertEqual(roll_up_deals(now=later), 1)
+        rollup = DealDailyRollup.objects.get(customer=self.customer)
+        self.assertEqual((rollup.deal_count, rollup.deal_total), (2, Decimal("15.00")))
+
+    def test_deal_analytics_endpoint(self):
+
+        big = Customer.objects.create(user=self.user, name="Big Spender", email="big@example.com", phone="1")
+        Deal.objects.create(title="Small", customer=self.customer, amount=Decimal("10.00"))
+        Deal.objects.create(title="Big", customer=big, amount=Decimal("500.00"))
+        Deal.objects.create(title="Foreign", customer=Customer.objects.create(
+            user=self.user2, name="Foreign", email="foreign@example.com", phone="2"), amount=Decimal("1.00"))
+        roll_up_deals(now=timezone.now() + datetime.timedelta(minutes=5))
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.get(reverse("crm:deal_analytics"), {"granularity": "month", "top": 1})
+
+        data = response.json()
+        self.assertEqual(len(data["series"]), 1)
+        self.assertEqual(data["series"][0]["deal_count"], 2)
+        self.assertEqual(Decimal(data["series"][0]["deal_total"]), Decimal("510.00"))
+        self.assertEqual([customer["name"] for customer in data["top_customers"]], ["Big Spender"])
+
+        bad = self.client.get(reverse("crm:deal_analytics"), {"granularity": "hour"})
+        self.assertEqual(bad.status_code, 400)
+
+    def test_deal_list_is_scoped_and_avoids_n_plus_one(self):
+
+        foreign = Customer.objects.create(user=self.user2, name="Foreign", email="foreign@example.com", phone="2")
+        Deal.objects.create(title="Foreign deal", customer=foreign, amount=10)
+        Deal.objects.create(title="Own deal", customer=self.customer, amount=10)
+        self.client.login(email="testuser@example.com", password="testpassword123")
+        self.client.get(reverse("crm:deal_list"))
+
+        with CaptureQueriesContext(connection) as one_deal:
+            response = self.client.get(reverse("crm:deal_list"))
+        self.assertContains(response, "Own deal")
+        self.assertNotContains(response, "Foreign deal")
+
+        for number in range(5):
+            other = Customer.objects.create(user=self.user, name=f"C{number}", email=f"c{number}@example.com", phone="1")
+            Deal.objects.create(title=f"Deal {number}", customer=other, amount=1)
+        with CaptureQueriesContext(connection) as six_deals:
+            self.client.get(reverse("crm:deal_list"))
+        self.assertEqual(len(one_deal), len(six_deals))
+
+    def test_deal_create_and_update_are_scoped(self):
+
+        foreign = Customer.objects.create(user=self.user2, name="Foreign", email="foreign@example.com", phone="2")
+        foreign_deal = Deal.objects.create(title="Foreign deal", customer=foreign, amount=10)
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.post(reverse("crm:deal_create"), {"title": "Sneaky", "customer": foreign.pk, "amount": "5"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Deal.objects.filter(title="Sneaky").exists())
+
+        response = self.client.post(reverse("crm:deal_create"), {"title": "Own", "customer": self.customer.pk, "amount": "5"})
+        self.assertRedirects(response, reverse("crm:deal_list"), fetch_redirect_response=False)
+
+        response = self.client.get(reverse("crm:deal_update", kwargs={"pk": foreign_deal.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_deal_form_picks_customer_by_id(self):
+
+        foreign = Customer.objects.create(user=self.user2, name="Foreign", email="foreign@example.com", phone="2")
+        own_deal = Deal.objects.create(title="Own deal", customer=self.customer, amount=10)
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.get(reverse("crm:deal_create"))
+        self.assertNotContains(response, self.customer.name)
+        self.assertContains(response, reverse("crm:customer_search_api"))
+
+        response = self.client.get(reverse("crm:deal_update", kwargs={"pk": own_deal.pk}))
+        self.assertContains(response, f'value="{self.customer.name}"')
+        self.assertContains(response, f'name="customer" value="{self.customer.pk}"')
+
+        response = self.client.post(reverse("crm:deal_create"), {"title": "Sneaky", "customer": foreign.pk, "amount": "5"})
+        self.assertContains(response, "Select one of your customers.")
+
+    def test_bulk_deal_ingestion(self):
+
+        foreign = Customer.objects.create(user=self.user2, name="Foreign", email="foreign@example.com", phone="2")
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        rows = [
+            {"customer": self.customer.pk, "title": "One", "amount": "10.50"},
+            {"customer": self.customer.pk, "title": "Two", "amount": "4.50"},
+            {"customer": foreign.pk, "title": "Foreign", "amount": "1"},
+            {"customer": self.customer.pk, "title": "Bad", "amount": "lots"},
+        ]
+        response = self.client.post(reverse("crm:deal_bulk_create"), json.dumps({"deals": rows}), content_type="application/json")
+
+        data = response.json()
+        self.assertEqual((data["imported"], data["failed"]), (2, 2))
+        self.assertEqual([error["line"] for error in data["errors"]], [2, 3])
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.deal_count, self.customer.deal_total), (2, Decimal("15.00")))
+        self.assertIsNotNone(self.customer.last_deal_at)
+        self.assertFalse(Deal.objects.filter(customer=foreign).exists())
+
+    def test_bulk_deal_ingestion_with_api_token(self):
+
+        client = Client(enforce_csrf_checks=True)
+        url = reverse("crm:deal_bulk_create")
+        body = json.dumps({"deals": [{"customer": self.customer.pk, "title": "One", "amount": "10.00"}]})
+        key = ApiToken.issue(self.user, "importer")
+
+        response = client.post(url, body, content_type="application/json", HTTP_AUTHORIZATION=f"Bearer {key}")
+        self.assertEqual(response.json()["imported"], 1)
+        self.assertTrue(Deal.objects.filter(customer=self.customer, title="One").exists())
+
+        response = client.post(url, body, content_type="application/json", HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 401)
+        response = client.post(url, body, content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+
+        # Session requests are still CSRF-checked.
+        client.login(email="testuser@example.com", password="testpassword123")
+        response = client.post(url, body, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+
+    def test_query_budget_reported_and_enforced(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        response = self.client.get(self.url)
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries"$')
+
+        with patch.object(CustomerListView, 'query_budget', 0):
+            cache.clear()
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(self.url)
+
+    def test_deal_list_budget_catches_n_plus_one(self):
+
+        for number in range(5):
+            Deal.objects.create(title=f"Deal {number}", customer=self.customer, amount=1)
+        self.client.login(email="testuser@example.com", password="testpassword123")
+
+        with patch.object(DealListView, 'get_queryset', lambda view: Deal.objects.filter(customer__user=view.request.user)):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("crm:deal_list"))
+
+    def test_metrics_endpoint(self):
+
+        self.client.login(email="testuser@example.com", password="testpassword123")
+        self.client.get(self.url)
+        self.client.get(self.url)
+
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'http_request_duration_seconds_count\{view="crm:customer_list",method="GET"\} [1-9]')
+        self.assertRegex(body, r'db_queries_total\{view="crm:customer_list"\} \d+')
+        self.assertIn('crm_customer_page_cache_hits_total', body)
+
+        with override_settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+            authorized = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual(authorized.status_code, 200)
+
+    def test_metrics_flush_off_the_event_loop(self):
+
+        registry = Registry()
+        registry.inc('db_queries_total', (('view', 'test:background'),), 3)
+        registry._last_flush -= 60
+
+        with patch('crm_project_vacancy.metrics.threading.Thread') as thread:
+            registry.maybe_flush(background=True)
+            registry.maybe_flush(background=True)
+        thread.assert_called_once()
+        self.assertEqual(cache.get('metrics:db_queries_total{view="test:background"}'), None)
+
+        thread.call_args.kwargs['target']()
+        self.assertEqual(cache.get('metrics:db_queries_total{view="test:background"}'), 3)
+        self.assertFalse(registry._flushing)
+
     def test_delete_customers_permission_error(self):
 
         self.client.login(email="testuser2@example.com", password="testpassword123")
@@ -196,4 +1062,66 @@ class CustomerViewsTests(TestCase):
 
         self.assertEqual(response.status_code, 500)
         self.assertJSONEqual(response.content, {"success": False, "message": "Database error"})
-        self.assertTrue(Customer.objects.filter(id=self.customer.id).exists())
\ No newline at end of file
+        self.assertTrue(Customer.objects.filter(id=self.customer.id).exists())
+
+
+class BenchmarkCommandTests(LiveServerTestCase):
+
+    def setUp(self):
+        rate_limiter.reset()
+
+    def test_benchmark_commands(self):
+
+        # Enough customers for both bulk_delete requests to delete something.
+        call_command("seed_benchmark_data", "--users", "1", "--customers-per-user", "150", "--deals-per-customer", "2", stdout=StringIO())
+        bench = get_user_model().objects.get(email="bench1@example.com")
+        self.assertEqual(bench.customers.count(), 150)
+        self.assertEqual(Deal.objects.filter(customer__user=bench).count(), 300)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            call_command(
+                "run_benchmarks", "--base-url", self.live_server_url, "--requests", "2", "--concurrency", "1",
+                "--output", output, stdout=StringIO(),
+            )
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertEqual(set(results["scenarios"]), {"customer_list", "customer_detail", "bulk_delete", "login", "signup"})
+        for summary in results["scenarios"].values():
+            self.assertEqual((summary["requests"], summary["errors"]), (2, 0))
+        self.assertFalse(bench.customers.exists())
+
+    @override_settings(RATE_LIMITS={'login': {'email': (2, 3600)}})
+    def test_benchmark_fails_on_error_responses(self):
+
+        call_command("seed_benchmark_data", "--users", "1", "--customers-per-user", "1", "--deals-per-customer", "0", stdout=StringIO())
+
+        with self.assertRaisesMessage(CommandError, "Requests failed in: login"):
+            call_command(
+                "run_benchmarks", "login", "--base-url", self.live_server_url, "--requests", "2",
+                "--concurrency", "1", stdout=StringIO(),
+            )
+
+    def test_failed_bulk_delete_counts_as_error(self):
+
+        call_command("seed_benchmark_data", "--users", "1", "--customers-per-user", "1", "--deals-per-customer", "0", stdout=StringIO())
+
+        # The second request has no customers left and gets success false.
+        with self.assertRaisesMessage(CommandError, "Requests failed in: bulk_delete"):
+            call_command(
+                "run_benchmarks", "bulk_delete", "--base-url", self.live_server_url, "--requests", "2",
+                "--concurrency", "1", stdout=StringIO(),
+            )
+
+    def test_benchmark_requests_over_http(self):
+
+        call_command("seed_benchmark_data", "--users", "1", "--customers-per-user", "1", "--deals-per-customer", "0", stdout=StringIO())
+        out = StringIO()
+
+        call_command(
+            "benchmark_requests", "--base-url", self.live_server_url, "--user", "bench1@example.com",
+            "--password", "benchpassword123", "--requests", "4", "--concurrency", "2", stdout=out,
+        )
+
+        self.assertIn("requests=4", out.getvalue())
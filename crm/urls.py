@@ -1,4 +1,6 @@
 from django.urls import path
+from crm_project_vacancy.routers import read_from_replica
+
 from . import views
 
 app_name = 'crm'
@@ -7,6 +9,19 @@ urlpatterns = [
     path('', views.CustomerListView.as_view(), name='customer_list'),
     path('<int:pk>/', views.CustomerDetailView.as_view(), name='customer_detail'),
     path('create/', views.CustomerCreateView.as_view(), name='customer_create'),
+    path('import/', views.CustomerImportView.as_view(), name='customer_import'),
+    path('export/', views.CustomerExportView.as_view(), name='customer_export'),
+    path('api/', read_from_replica(views.CustomerListApiView.as_view()), name='customer_list_api'),
+    path('api/search/', read_from_replica(views.CustomerSearchApiView.as_view()), name='customer_search_api'),
+    path('events/', views.CustomerEventStreamView.as_view(), name='customer_events'),
+    path('api/changes/', views.CustomerChangesApiView.as_view(), name='customer_changes_api'),
+    path('api/<int:pk>/', read_from_replica(views.CustomerDetailApiView.as_view()), name='customer_detail_api'),
+    path('deals/', views.DealListView.as_view(), name='deal_list'),
+    path('deals/create/', views.DealCreateView.as_view(), name='deal_create'),
+    path('deals/<int:pk>/update/', views.DealUpdateView.as_view(), name='deal_update'),
+    path('deals/bulk/', views.DealBulkCreateView.as_view(), name='deal_bulk_create'),
+    path('analytics/deals/', views.DealAnalyticsView.as_view(), name='deal_analytics'),
+    path('bulk-delete/<str:job_id>/', views.BulkDeleteStatusView.as_view(), name='bulk_delete_status'),
     path('<int:pk>/update/', views.CustomerUpdateView.as_view(), name='customer_update'),
     path('<int:pk>/delete/', views.CustomerDeleteView.as_view(), name='customer_delete'),
 ]
@@ -1,18 +1,71 @@
+import asyncio
+import datetime
+import io
 import json
+import uuid
 
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.views import View
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, FormView
+from django.urls import reverse, reverse_lazy
 from django.shortcuts import render, redirect
-from django.http import HttpResponseRedirect, JsonResponse, Http404
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django.contrib import messages
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+from django_htmx.http import reswap, retarget
+from custom_auth.decorators import login_exempt, token_auth
+from crm_project_vacancy.query_budget import query_budget
+from crm_project_vacancy.routers import read_from_replica
 
-from .models import Customer
-from .forms import CustomerForm
+from .models import Customer, Deal
+from .forms import CustomerForm, CustomerImportUploadForm, DealForm
+from .deals import DEAL_INGEST_MAX_ROWS, ingest_deals
+from .importers import detect_format, import_customers
+from .exporters import EXPORT_FORMATS, aiter_export, iter_export
+from .changes import CHANGES_MAX_PAGE_SIZE, CHANGES_PAGE_SIZE, CursorExpired, customer_changes
+from .events import customer_events
+from .deletion import BULK_DELETE_ASYNC_THRESHOLD, PENDING, delete_customers, get_job, set_job
+from .celery_tasks import delete_customers_job
+from .caching import (
+    get_cached_page, get_customer_count,
+    customer_list_etag, customer_list_last_modified, customer_detail_etag, customer_detail_last_modified,
+)
+from .pagination import KeysetPage, KeysetPaginator
+from .rollups import GRANULARITIES, deal_analytics
+from .search import search_customers
 
+# Pages are revalidated on every view; unchanged ones come back as 304.
+revalidate = [cache_control(private=True, no_cache=True), vary_on_headers('HX-Request')]
+
+
+def _served_over_asgi(request):
+    # Streams must be async iterators under ASGI and sync ones under WSGI;
+    # Django reads the other kind to the end before sending anything.
+    return isinstance(request, ASGIRequest)
+
+
+# Budgets allow for a cold session and user cache (two queries). The list's
+# also covers the synchronous bulk delete posted to it.
+@query_budget(8)
+@method_decorator(read_from_replica, name='get')
+@method_decorator(revalidate, name='get')
+@method_decorator(condition(etag_func=customer_list_etag, last_modified_func=customer_list_last_modified), name='get')
 class CustomerListView(ListView):
     model = Customer
     template_name = 'crm/customer_list.html'
     context_object_name = 'customers'
+    ordering = ('-created_at', '-id')
+    # Both orderings are covered by an index on (user, ..., id).
+    sort_orderings = {
+        'recent': ('-created_at', '-id'),
+        'revenue': ('-deal_total', '-id'),
+    }
+    page_size = 50
 
     def dispatch(self, request, *args, **kwargs):
         if request.user.is_authenticated:
@@ -26,38 +79,95 @@ class CustomerListView(ListView):
 
     def get_queryset(self):
 
-        return Customer.objects.filter(user=self.request.user)
+        return Customer.objects.filter(user=self.request.user).order_by(*self.get_ordering())
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort', 'recent')
+        return sort if sort in self.sort_orderings else 'recent'
+
+    def get_ordering(self):
+        return self.sort_orderings[self.get_sort()]
+
+    def get_template_names(self):
+        if self.request.htmx:
+            return ['crm/customer_table.html']
+        return super().get_template_names()
+
+    def get_context_data(self, **kwargs):
+        search_query = self.request.GET.get('q', '').strip()
+        cursor = self.request.GET.get('cursor')
+
+        sort = self.get_sort()
+
+        page = get_cached_page(
+            self.request.user.pk, (search_query, cursor, sort), lambda: self.get_page(search_query, cursor)
+        )
+        kwargs.update(
+            object_list=page.object_list,
+            page_obj=page,
+            is_paginated=page.has_other_pages(),
+            search_query=search_query,
+            sort=sort,
+            customer_count=get_customer_count(self.request.user.pk, self.object_list),
+            live_updates=_served_over_asgi(self.request),
+        )
+        return super().get_context_data(**kwargs)
+
+    def get_page(self, search_query, cursor):
+        if search_query:
+            return KeysetPage(list(search_customers(self.object_list, search_query)))
+
+        paginator = KeysetPaginator(self.object_list, self.get_ordering(), self.page_size)
+        return paginator.page(cursor)
 
     def post(self, request, *args, **kwargs):
         try:
             data = json.loads(request.body)
-            ids_to_delete = data.get('ids', [])
+            ids_to_delete = [int(pk) for pk in data.get('ids', [])]
 
-            if ids_to_delete:
+            if not ids_to_delete:
+                return JsonResponse({'success': False, 'error': 'IDs for deletion not specified'})
 
-                deleted_count, _ = Customer.objects.filter(
-                    id__in=ids_to_delete, user=request.user
-                ).delete()
+            if len(ids_to_delete) > BULK_DELETE_ASYNC_THRESHOLD:
+                job_id = uuid.uuid4().hex
+                set_job(job_id, user_id=request.user.pk, status=PENDING, total=len(ids_to_delete), processed=0, deleted=0)
+                delete_customers_job.delay(job_id, request.user.pk, ids_to_delete)
+                return JsonResponse({
+                    'success': True,
+                    'job_id': job_id,
+                    'status_url': reverse('crm:bulk_delete_status', kwargs={'job_id': job_id}),
+                }, status=202)
 
-                if deleted_count > 0:
-                    return JsonResponse({'success': True, 'deleted_count': deleted_count})
-                else:
-                    return JsonResponse({'success': False, 'error': 'You do not have permission to delete these entries'})
+            deleted_count = delete_customers(request.user.pk, ids_to_delete)
 
-            return JsonResponse({'success': False, 'error': 'IDs for deletion not specified'})
+            if deleted_count > 0:
+                return JsonResponse({'success': True, 'deleted_count': deleted_count})
+            else:
+                return JsonResponse({'success': False, 'error': 'You do not have permission to delete these entries'})
 
         except json.JSONDecodeError:
             return JsonResponse({'success': False, 'error': 'Invalid JSON'})
+        except (TypeError, ValueError):
+            return JsonResponse({'success': False, 'error': 'Invalid IDs'})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
 
+@query_budget(4)
+@method_decorator(read_from_replica, name='get')
+@method_decorator(revalidate, name='get')
+@method_decorator(condition(etag_func=customer_detail_etag, last_modified_func=customer_detail_last_modified), name='get')
 class CustomerDetailView(DetailView):
     model = Customer
     template_name = 'crm/customer_detail.html'
 
+    def get_template_names(self):
+        if self.request.htmx:
+            return ['crm/customer_row.html']
+        return super().get_template_names()
+
     def get_object(self, queryset=None):
         obj = super().get_object(queryset=queryset)
-        if obj.user != self.request.user:
+        if obj.user_id != self.request.user.pk:
             raise Http404("You do not have access to this entry.")
         return obj
 
@@ -67,6 +177,11 @@ class CustomerCreateView(CreateView):
     template_name = 'crm/customer_form.html'
     form_class = CustomerForm
 
+    def get_template_names(self):
+        if self.request.htmx:
+            return ['crm/customer_form_fragment.html']
+        return super().get_template_names()
+
     def get_success_url(self):
         return reverse_lazy('crm:customer_detail', kwargs={'pk': self.object.pk})
 
@@ -75,12 +190,22 @@ class CustomerCreateView(CreateView):
         for field, error_list in form.errors.items():
             for error in error_list:
                 errors.append(f"{field.capitalize()}: {error}")
+
+        if self.request.htmx:
+            response = render(self.request, 'crm/customer_form_fragment.html', {'form': form, 'errors': errors})
+            return reswap(retarget(response, '#customer-form-slot'), 'innerHTML')
         return render(self.request, 'crm/customer_form.html', {'form': form, 'errors': errors})
 
     def form_valid(self, form):
         self.object = form.save(commit=False)
         self.object.user = self.request.user
         self.object.save()
+
+        if self.request.htmx:
+            return render(self.request, 'crm/customer_create_success.html', {
+                'customer': self.object,
+                'customer_count': get_customer_count(self.request.user.pk, Customer.objects.filter(user=self.request.user)),
+            })
         return HttpResponseRedirect(reverse_lazy('crm:customer_list'))
 
 
@@ -91,17 +216,31 @@ class CustomerUpdateView(UpdateView):
 
     def get_object(self, queryset=None):
         obj = super().get_object(queryset=queryset)
-        if obj.user != self.request.user:
+        if obj.user_id != self.request.user.pk:
             raise Http404("You cannot edit this entry.")
         return obj
 
+    def get_template_names(self):
+        if self.request.htmx:
+            return ['crm/customer_row_form.html']
+        return super().get_template_names()
+
     def form_invalid(self, form):
         errors = []
         for field, error_list in form.errors.items():
             for error in error_list:
                 errors.append(f"{field.capitalize()}: {error}")
+
+        if self.request.htmx:
+            return render(self.request, 'crm/customer_row_form.html', {'form': form, 'errors': errors, 'customer': self.object})
         return render(self.request, 'crm/customer_edit.html', {'form': form, 'errors': errors})
 
+    def form_valid(self, form):
+        if self.request.htmx:
+            self.object = form.save()
+            return render(self.request, 'crm/customer_row.html', {'customer': self.object})
+        return super().form_valid(form)
+
     def get_success_url(self):
         return reverse_lazy('crm:customer_detail', kwargs={'pk': self.object.pk})
 
@@ -112,7 +251,7 @@ class CustomerDeleteView(DeleteView):
 
     def get_object(self, queryset=None):
         obj = super().get_object(queryset=queryset)
-        if obj.user != self.request.user:
+        if obj.user_id != self.request.user.pk:
             raise Http404("You cannot remove this entry.")
         return obj
 
@@ -120,6 +259,12 @@ class CustomerDeleteView(DeleteView):
         self.object = self.get_object()
         try:
             self.object.delete()
+            if request.htmx:
+                # The row swaps itself out with the empty body; only the count changes.
+                return render(request, 'crm/customer_count.html', {
+                    'oob': True,
+                    'customer_count': get_customer_count(request.user.pk, Customer.objects.filter(user=request.user)),
+                })
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return JsonResponse({'success': True})
             else:
@@ -127,3 +272,251 @@ class CustomerDeleteView(DeleteView):
         except Exception as e:
             return JsonResponse({'success': False, 'message': str(e)}, status=500)
 
+
+
+class CustomerImportView(FormView):
+    template_name = 'crm/customer_import.html'
+    form_class = CustomerImportUploadForm
+
+    def form_valid(self, form):
+        upload = form.cleaned_data['file']
+        file_format = form.cleaned_data['format'] or detect_format(upload.name)
+
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        report = import_customers(self.request.user, stream, file_format)
+
+        if report.imported:
+            messages.success(self.request, f"Imported {report.imported} of {report.processed} rows.")
+        return self.render_to_response(self.get_context_data(form=form, report=report))
+
+
+@method_decorator(read_from_replica, name='get')
+class CustomerExportView(View):
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return HttpResponseBadRequest("Unknown export format.")
+
+        content_type, extension = EXPORT_FORMATS[export_format]
+        compress = request.GET.get('gzip') == '1'
+        filename = f"customers.{extension}"
+        if compress:
+            content_type, filename = 'application/gzip', f"{filename}.gz"
+
+        export = aiter_export if _served_over_asgi(request) else iter_export
+        response = StreamingHttpResponse(export(request.user, export_format, compress), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class BulkDeleteStatusView(View):
+
+    def get(self, request, job_id):
+        job = get_job(job_id)
+        if job is None or job['user_id'] != request.user.pk:
+            raise Http404("Bulk delete job not found.")
+        return render(request, 'crm/bulk_delete_progress.html', {'job': job, 'job_id': job_id})
+
+
+@method_decorator(read_from_replica, name='get')
+class DealAnalyticsView(View):
+    default_days = 30
+    max_top = 50
+
+    def get(self, request, *args, **kwargs):
+        try:
+            end = datetime.date.fromisoformat(request.GET['end']) if 'end' in request.GET else timezone.localdate()
+            start = (
+                datetime.date.fromisoformat(request.GET['start']) if 'start' in request.GET
+                else end - datetime.timedelta(days=self.default_days - 1)
+            )
+            top = max(0, min(int(request.GET.get('top', 5)), self.max_top))
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'Invalid start, end or top'}, status=400)
+
+        granularity = request.GET.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            return JsonResponse({'success': False, 'error': 'Unknown granularity'}, status=400)
+        if start > end:
+            return JsonResponse({'success': False, 'error': 'start must not be after end'}, status=400)
+
+        return JsonResponse(deal_analytics(request.user, start, end, granularity, top))
+
+
+@query_budget(4)
+@method_decorator(read_from_replica, name='get')
+class DealListView(ListView):
+    model = Deal
+    template_name = 'crm/deal_list.html'
+    context_object_name = 'deals'
+    ordering = ('-created_at', '-id')
+    page_size = 50
+
+    def get_queryset(self):
+        queryset = Deal.objects.filter(customer__user=self.request.user).select_related('customer')
+        customer_id = self.request.GET.get('customer')
+        if customer_id and customer_id.isdigit():
+            queryset = queryset.filter(customer_id=customer_id)
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        page = KeysetPaginator(self.object_list, self.ordering, self.page_size).page(self.request.GET.get('cursor'))
+        kwargs.update(object_list=page.object_list, page_obj=page, is_paginated=page.has_other_pages())
+        return super().get_context_data(**kwargs)
+
+
+class DealFormMixin:
+    model = Deal
+    form_class = DealForm
+    template_name = 'crm/deal_form.html'
+    success_url = reverse_lazy('crm:deal_list')
+
+    def get_queryset(self):
+        return Deal.objects.filter(customer__user=self.request.user).select_related('customer')
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+
+class DealCreateView(DealFormMixin, CreateView):
+    pass
+
+
+class DealUpdateView(DealFormMixin, UpdateView):
+    pass
+
+
+@login_exempt
+@method_decorator(token_auth, name='dispatch')
+class DealBulkCreateView(View):
+
+    def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+
+        rows = data.get('deals') if isinstance(data, dict) else None
+        if not isinstance(rows, list) or not rows:
+            return JsonResponse({'success': False, 'error': 'Deals not specified'}, status=400)
+        if len(rows) > DEAL_INGEST_MAX_ROWS:
+            return JsonResponse(
+                {'success': False, 'error': f'At most {DEAL_INGEST_MAX_ROWS} deals per request'}, status=413
+            )
+
+        report = ingest_deals(request.user, rows)
+        return JsonResponse({'success': report.failed == 0, **report.as_dict()})
+
+
+class CustomerApiView(View):
+
+    # Async JSON reads. Under ASGI a request waiting on the database or a
+    # slow client holds a coroutine instead of a worker thread. Routed
+    # through read_from_replica in urls.py, since method_decorator cannot
+    # wrap async handlers.
+
+    fields = ('id', 'name', 'email', 'phone', 'created_at', 'updated_at', 'deal_count', 'deal_total', 'last_deal_at')
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.user = await request.auser()
+        if not self.user.email_verified:
+            return JsonResponse({'success': False, 'error': 'Email not verified'}, status=403)
+        return await super().dispatch(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return Customer.objects.filter(user=self.user).only(*self.fields)
+
+    def serialize(self, customer):
+        return {field: getattr(customer, field) for field in self.fields}
+
+
+@query_budget(4)
+class CustomerListApiView(CustomerApiView):
+    page_size = 50
+
+    async def get(self, request, *args, **kwargs):
+        sort = request.GET.get('sort', 'recent')
+        ordering = CustomerListView.sort_orderings.get(sort, CustomerListView.ordering)
+        page = await KeysetPaginator(self.get_queryset(), ordering, self.page_size).apage(request.GET.get('cursor'))
+        return JsonResponse({
+            'customers': [self.serialize(customer) for customer in page],
+            'next_cursor': page.next_cursor,
+            'previous_cursor': page.previous_cursor,
+        })
+
+
+@query_budget(3)
+class CustomerDetailApiView(CustomerApiView):
+
+    async def get(self, request, pk, *args, **kwargs):
+        try:
+            customer = await self.get_queryset().aget(pk=pk)
+        except Customer.DoesNotExist:
+            raise Http404("You do not have access to this entry.")
+        return JsonResponse({'customer': self.serialize(customer)})
+
+
+@query_budget(3)
+class CustomerSearchApiView(CustomerApiView):
+
+    async def get(self, request, *args, **kwargs):
+        search_query = request.GET.get('q', '').strip()
+        if not search_query:
+            return JsonResponse({'success': False, 'error': 'Search query not specified'}, status=400)
+
+        results = search_customers(self.get_queryset(), search_query)
+        return JsonResponse({'customers': [self.serialize(customer) async for customer in results.aiterator()]})
+
+
+# Not routed to replicas: one lagging by more than CHANGES_SETTLE would let
+# the cursor move past rows it has not seen yet.
+@query_budget(4)
+class CustomerChangesApiView(CustomerApiView):
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            limit = max(1, min(int(request.GET.get('limit', CHANGES_PAGE_SIZE)), CHANGES_MAX_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'Invalid limit'}, status=400)
+
+        try:
+            changes = await customer_changes(self.user, request.GET.get('cursor'), limit)
+        except CursorExpired:
+            return JsonResponse({'success': False, 'error': 'Cursor expired, sync again without a cursor'}, status=410)
+
+        changes['customers'] = [self.serialize(customer) for customer in changes['customers']]
+        return JsonResponse(changes)
+
+
+class CustomerEventStreamView(View):
+
+    # Server-Sent Events feed of the user's customer changes (crm.events),
+    # consumed by customer_list.html. Each open tab costs a coroutine and a
+    # queue rather than a worker thread. Clients reconnect on their own
+    # after a dropped connection and then reload the list.
+
+    async def get(self, request, *args, **kwargs):
+        if not _served_over_asgi(request):
+            # A WSGI server would hold a thread per tab reading the endless
+            # stream to the end; 204 tells EventSource not to reconnect.
+            return HttpResponse(status=204)
+        user = await request.auser()
+        response = StreamingHttpResponse(self.stream(user.pk), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stops nginx from buffering the stream.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, user_id):
+        async with customer_events.subscribe(user_id) as queue:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), settings.CUSTOMER_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: customer\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from crm.caching import cache_stats
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'metrics:'
+INDEX_KEY = 'metrics:index'
+FLUSH_INTERVAL = 10
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUEUE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+# name -> (type, help). Series ending in _seconds_sum or _seconds_total are
+# kept in integer microseconds so they can be summed with cache.incr().
+METRICS = {
+    'http_request_duration_seconds': ('histogram', "Request latency by URL name."),
+    'db_queries_total': ('counter', "SQL queries run while handling requests."),
+    'db_query_duration_seconds_total': ('counter', "Time spent in SQL queries while handling requests."),
+    'email_tasks_total': ('counter', "Confirmation/reset emails by event: queued, sent, retried, failed."),
+    'email_queue_wait_seconds': ('histogram', "Time from queueing an email to handing it to SMTP."),
+    'rate_limited_total': ('counter', "Auth form posts rejected by the rate limiter, by scope."),
+}
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    rendered = ','.join(f'{key}="{value}"' for key, value in labels)
+    return f'{name}{{{rendered}}}'
+
+
+def _is_microseconds(series):
+    name = series.split('{', 1)[0]
+    return name.endswith('_seconds_sum') or name.endswith('_seconds_total')
+
+
+class Registry:
+
+    # Counts locally and adds the deltas to shared cache counters at most
+    # every FLUSH_INTERVAL seconds, so a request costs a few dict updates
+    # and /metrics sees the totals of every web and Celery process.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._known = set()
+        self._last_flush = time.monotonic()
+        self._flushing = False
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._pending[_series(name, labels)] += value
+
+    def add_seconds(self, name, labels, seconds):
+        self.inc(name, labels, int(seconds * 1_000_000))
+
+    def observe(self, name, labels, seconds, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            for bound in buckets:
+                if seconds <= bound:
+                    self._pending[_series(f'{name}_bucket', (*labels, ('le', bound)))] += 1
+            self._pending[_series(f'{name}_bucket', (*labels, ('le', '+Inf')))] += 1
+            self._pending[_series(f'{name}_count', labels)] += 1
+            self._pending[_series(f'{name}_sum', labels)] += int(seconds * 1_000_000)
+
+    def maybe_flush(self, background=False):
+        # background=True hands the flush to a thread, for callers on an
+        # event loop that must not wait for the cache.
+        if time.monotonic() - self._last_flush < FLUSH_INTERVAL:
+            return
+        if not background:
+            self.flush()
+            return
+        with self._lock:
+            if self._flushing:
+                return
+            self._flushing = True
+        threading.Thread(target=self._flush_in_background, name='metrics-flush', daemon=True).start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as exc:
+            logger.warning("Could not flush metrics: %s", exc)
+        finally:
+            self._flushing = False
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+
+        _incr_many({KEY_PREFIX + series: value for series, value in pending.items()})
+
+        # Last writer wins; every process re-adds all series it knows on each
+        # flush, so the index converges (and survives a cache restart).
+        self._known |= set(pending)
+        cache.set(INDEX_KEY, (cache.get(INDEX_KEY) or set()) | self._known, timeout=None)
+
+    def collect(self):
+        self.flush()
+        index = sorted(cache.get(INDEX_KEY) or ())
+        values = cache.get_many([KEY_PREFIX + series for series in index])
+        return {series: values.get(KEY_PREFIX + series, 0) for series in index}
+
+
+def _incr_many(deltas):
+    # `cache` is a proxy; isinstance needs the backend itself.
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if isinstance(backend, RedisCache):
+        # One pipelined round trip. The cache stores ints unpickled, so
+        # INCRBY works on its keys and creates missing ones without expiry.
+        keys = {backend.make_and_validate_key(key): value for key, value in deltas.items()}
+        pipeline = backend._cache.get_client(write=True).pipeline(transaction=False)
+        for key, value in keys.items():
+            pipeline.incrby(key, value)
+        pipeline.execute()
+        return
+
+    for key, value in deltas.items():
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, value)
+
+
+registry = Registry()
+
+
+def render(samples, extra=()):
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        family = [series for series in samples if series.split('{', 1)[0] in _family_names(name, metric_type)]
+        if not family:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for series in family:
+            value = samples[series]
+            lines.append(f'{series} {value / 1_000_000 if _is_microseconds(series) else value}')
+
+    for name, metric_type, help_text, value in extra:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _family_names(name, metric_type):
+    if metric_type == 'histogram':
+        return {f'{name}_bucket', f'{name}_count', f'{name}_sum'}
+    return {name}
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+
+    stats = cache_stats()
+    extra = [
+        ('crm_customer_page_cache_hits_total', 'counter', "Customer list page cache hits.", stats['hits']),
+        ('crm_customer_page_cache_misses_total', 'counter', "Customer list page cache misses.", stats['misses']),
+        ('crm_customer_page_cache_hit_ratio', 'gauge', "Customer list page cache hit ratio.", stats['hit_ratio']),
+    ]
+    return HttpResponse(render(registry.collect(), extra), content_type='text/plain; version=0.0.4; charset=utf-8')
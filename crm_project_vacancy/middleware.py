@@ -0,0 +1,208 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+from .metrics import registry
+from .query_budget import QueryBudgetExceeded, QueryCounter, get_query_budget, track_queries
+from .routers import mark_sticky
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+
+
+class CompressionMiddleware(GZipMiddleware):
+
+    # Brotli for clients that accept it (and when the package is installed),
+    # Django's gzip handling for everyone else.
+
+    def process_response(self, request, response):
+        # Compressors hold data back until they have enough to emit, which
+        # would delay every event of a live stream.
+        if response.get("Content-Type", "").startswith("text/event-stream"):
+            return response
+
+        ae = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if brotli is None or not re_accepts_brotli.search(ae) or not self._should_compress(response):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self._acompress_stream(response.streaming_content)
+            else:
+                response.streaming_content = self._compress_stream(response.streaming_content)
+            del response.headers["Content-Length"]
+        else:
+            compressed_content = brotli.compress(response.content, quality=5)
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response.headers["Content-Length"] = str(len(response.content))
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
+
+    def _should_compress(self, response):
+        # Same preconditions as GZipMiddleware.
+        if not response.streaming and len(response.content) < 200:
+            return False
+        if response.has_header("Content-Encoding"):
+            return False
+        return True
+
+    def _compress_stream(self, chunks):
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+    async def _acompress_stream(self, chunks):
+        compressor = brotli.Compressor(quality=5)
+        async for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+class AsyncCapableMiddleware:
+
+    # Base for middleware that wraps get_response: runs natively in whichever
+    # mode the handler chain uses, so async views under ASGI are not pushed
+    # onto a thread. Subclasses implement __call__ for the sync case and
+    # __acall__ for the async one.
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+class ReplicaStickinessMiddleware(AsyncCapableMiddleware):
+
+    # After a user writes, their reads stay on the primary for a few seconds.
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if request.method not in self.SAFE_METHODS and settings.DATABASE_REPLICAS:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                mark_sticky(user.pk)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if request.method not in self.SAFE_METHODS and settings.DATABASE_REPLICAS:
+            user = await request.auser()
+            if user.is_authenticated:
+                await sync_to_async(mark_sticky)(user.pk)
+        return response
+
+
+class QueryBudgetMiddleware(AsyncCapableMiddleware):
+
+    # Development and test only (see settings). Counts the queries and DB
+    # time of each request, reports them in a Server-Timing header and checks
+    # them against the view's @query_budget. Queries run while a streaming
+    # body is produced are not counted.
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        request.query_budget = None
+
+        with track_queries(counter):
+            response = self.get_response(request)
+        return self.check(request, response, counter)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        request.query_budget = None
+
+        stack = await sync_to_async(track_queries)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.check(request, response, counter)
+
+    def check(self, request, response, counter):
+        response.headers["Server-Timing"] = (
+            f'db;dur={counter.duration * 1000:.1f};desc="{counter.count} queries"'
+        )
+
+        budget = request.query_budget
+        if budget is not None and counter.count > budget:
+            message = f"{request.method} {request.path} ran {counter.count} queries, budget is {budget}"
+            if settings.QUERY_BUDGET_ENFORCE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func)
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+
+    # Records latency, query count and DB time per URL name into the
+    # metrics registry served at /metrics.
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+
+        with track_queries(counter):
+            response = self.get_response(request)
+        self.record(request, counter, started)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+
+        stack = await sync_to_async(track_queries)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, counter, started, background=True)
+        return response
+
+    def record(self, request, counter, started, background=False):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        registry.observe('http_request_duration_seconds', (('view', view), ('method', request.method)), time.perf_counter() - started)
+        registry.inc('db_queries_total', (('view', view),), counter.count)
+        registry.add_seconds('db_query_duration_seconds_total', (('view', view),), counter.duration)
+        # On the event loop the flush runs in a thread, so a slow cache
+        # round trip never stalls the other connections of the worker.
+        registry.maybe_flush(background=background)
@@ -0,0 +1,50 @@
+import time
+
+from contextlib import ExitStack
+from django.db import connections
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries):
+    # Declares how many SQL queries one request to the view may run.
+    # QueryBudgetMiddleware enforces it under test and warns in development.
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def get_query_budget(view_func):
+    view_class = getattr(view_func, 'view_class', None)
+    budget = getattr(view_func, 'query_budget', None)
+    return budget if budget is not None else getattr(view_class, 'query_budget', None)
+
+
+class QueryCounter:
+
+    # Installed with connection.execute_wrapper() for the duration of a request.
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+def track_queries(counter):
+    # Installs counter on every connection of the calling thread; closing the
+    # returned stack removes it. Async code must call both through
+    # sync_to_async so they run on the thread the ORM uses.
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(counter))
+    return stack
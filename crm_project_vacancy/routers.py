@@ -0,0 +1,122 @@
+import random
+
+from asgiref.sync import iscoroutinefunction
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+
+STICKY_KEY = 'db:sticky:{user_id}'
+# Only these apps are read from replicas; sessions and users always come
+# from the primary so a fresh login or password change is seen immediately.
+REPLICA_APPS = {'crm'}
+
+# The replica the current request reads from, or None for the primary.
+_use_replica = ContextVar('use_replica', default=None)
+
+
+@contextmanager
+def replica_reads(alias=None):
+    # Picks one replica for the whole block (keeping one chosen further up),
+    # so the count and page queries of a request see the same replication
+    # point. Yields the alias, to continue on it later with replica_reads(alias).
+    alias = alias or _use_replica.get()
+    if alias is None and settings.DATABASE_REPLICAS:
+        alias = random.choice(settings.DATABASE_REPLICAS)
+    token = _use_replica.set(alias)
+    try:
+        yield alias
+    finally:
+        _use_replica.reset(token)
+
+
+def mark_sticky(user_id):
+    # Replicas lag behind the primary; keep this user's reads on the primary
+    # long enough for their own writes to reach the replicas.
+    cache.set(STICKY_KEY.format(user_id=user_id), 1, timeout=settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(user_id):
+    return cache.get(STICKY_KEY.format(user_id=user_id)) is not None
+
+
+async def ais_sticky(user_id):
+    return await cache.aget(STICKY_KEY.format(user_id=user_id)) is not None
+
+
+def read_from_replica(view):
+    if iscoroutinefunction(view):
+        return _async_read_from_replica(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.DATABASE_REPLICAS or is_sticky(request.user.pk):
+            return view(request, *args, **kwargs)
+
+        with replica_reads() as alias:
+            response = view(request, *args, **kwargs)
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = _aiter_on_replica(aiter(response.streaming_content), alias)
+            else:
+                response.streaming_content = _iter_on_replica(iter(response.streaming_content), alias)
+        return response
+
+    return wrapper
+
+
+def _async_read_from_replica(view):
+    # The ORM's sync_to_async calls copy the context, so the flag set here
+    # reaches the thread that runs the queries.
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not settings.DATABASE_REPLICAS or await ais_sticky(user.pk):
+            return await view(request, *args, **kwargs)
+
+        with replica_reads():
+            return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _iter_on_replica(chunks, alias):
+    # Streaming bodies are produced after the view returns.
+    while True:
+        with replica_reads(alias):
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+        yield chunk
+
+
+async def _aiter_on_replica(chunks, alias):
+    while True:
+        with replica_reads(alias):
+            try:
+                chunk = await anext(chunks)
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = _use_replica.get()
+        if alias and model._meta.app_label in REPLICA_APPS:
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 
 from dotenv import load_dotenv
 from pathlib import Path
@@ -30,6 +31,8 @@ SECRET_KEY = os.getenv('DJANGO_SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+TESTING = 'test' in sys.argv[1:2]
+
 ALLOWED_HOSTS = []
 
 
@@ -51,6 +54,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'crm_project_vacancy.middleware.MetricsMiddleware',
+    'crm_project_vacancy.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -59,8 +64,18 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django_htmx.middleware.HtmxMiddleware',
     'custom_auth.middleware.LoginRequiredMiddleware',
+    'crm_project_vacancy.middleware.ReplicaStickinessMiddleware',
 ]
 
+# Bearer token Prometheus must send to /metrics; unset leaves it open.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Per-request query counting and @query_budget checks: a warning in
+# development, a test failure under `manage.py test`.
+QUERY_BUDGET_ENFORCE = TESTING
+if DEBUG or TESTING:
+    MIDDLEWARE.insert(1, 'crm_project_vacancy.middleware.QueryBudgetMiddleware')
+
 ROOT_URLCONF = 'crm_project_vacancy.urls'
 
 TEMPLATES = [
@@ -91,6 +106,17 @@ DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_HOST = os.getenv('DB_HOST')
 DB_PORT = os.getenv('DB_PORT')
 
+# 'persistent' reuses one connection per thread with a health check before
+# reuse, 'pool' uses psycopg 3's connection pool, 'none' connects per request.
+# Web and Celery processes size these separately (see docker-compose.yml).
+# The web service runs under uvicorn (ASGI), where connections are not
+# reused across requests, so it uses 'pool'.
+DB_CONN_MODE = os.getenv('DB_CONN_MODE', 'persistent')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+
 
 DATABASES = {
 
@@ -102,6 +128,58 @@ DATABASES = {
         'PASSWORD': DB_PASSWORD,
         'HOST': DB_HOST,
         'PORT': DB_PORT,
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE if DB_CONN_MODE == 'persistent' else 0,
+        'CONN_HEALTH_CHECKS': DB_CONN_MODE == 'persistent',
+        'OPTIONS': {
+
+            'pool': {
+                'min_size': DB_POOL_MIN_SIZE,
+                'max_size': DB_POOL_MAX_SIZE,
+                'timeout': DB_POOL_TIMEOUT,
+            },
+
+        } if DB_CONN_MODE == 'pool' else {},
+
+    }
+
+}
+
+# Comma-separated host:port list of streaming replicas. CRM list, detail,
+# search and export reads go to them (see crm_project_vacancy.routers);
+# everything else, and a user's reads right after they write, use default.
+DB_REPLICA_HOSTS = [host for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host]
+
+DATABASE_REPLICAS = []
+for number, replica in enumerate(DB_REPLICA_HOSTS, start=1):
+    replica_host, _, replica_port = replica.partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DB_PORT,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['crm_project_vacancy.routers.PrimaryReplicaRouter']
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+
+    'default': {
+
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        # The default of 300 keys starts culling once the per-series metrics
+        # counters pile up over a test run; Redis has no such limit.
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+
+    } if TESTING else {
+
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/2",
 
     }
 
@@ -180,12 +258,18 @@ EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
+EMAIL_TIMEOUT = 10
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = os.getenv("EMAIL_HOST_USER")
 
 AUTH_USER_MODEL = 'custom_auth.User'
 
+AUTHENTICATION_BACKENDS = ['custom_auth.backends.CachedModelBackend']
+
+# Sessions are read from the cache and written through to the database.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 LOGIN_URL = '/auth/login'
 LOGIN_REDIRECT_URL = '/customers/'
 LOGOUT_REDIRECT_URL = '/auth/login'
@@ -194,3 +278,42 @@ CELERY_BROKER_URL = f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_BACKEND = f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/0"
+CELERY_TASK_ALWAYS_EAGER = TESTING
+CELERY_IMPORTS = ['custom_auth.celery_tasks', 'crm.celery_tasks']
+CELERY_BEAT_SCHEDULE = {
+    'update-deal-rollups': {
+        'task': 'crm.celery_tasks.update_deal_rollups',
+        'schedule': 60.0,
+    },
+    'purge-customer-tombstones': {
+        'task': 'crm.celery_tasks.purge_customer_tombstones',
+        'schedule': 24 * 60 * 60.0,
+    },
+}
+
+# Outgoing emails are collected for EMAIL_BATCH_WINDOW seconds and sent over
+# one pooled SMTP connection per worker.
+EMAIL_QUEUE_REDIS_URL = None if TESTING else f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/1"
+EMAIL_BATCH_WINDOW = 2
+EMAIL_BATCH_SIZE = 100
+
+# Live customer list updates (crm.events): Redis pub/sub carries change
+# events to every web process; unset keeps them within the process.
+CUSTOMER_EVENTS_REDIS_URL = None if TESTING else f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/1"
+# Seconds between SSE comments that keep idle connections open through proxies.
+CUSTOMER_EVENTS_KEEPALIVE = 15
+
+# Token buckets for the auth forms (custom_auth.ratelimit), as
+# (capacity, seconds to refill it) per client IP and per submitted email.
+RATE_LIMIT_REDIS_URL = None if TESTING else f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/1"
+# Number of reverse proxies in front of the app. Must match the deployment:
+# with 0 behind a proxy every client shares the proxy's IP bucket, and a
+# count that is too high lets clients pick their IP via X-Forwarded-For.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+# RATE_LIMITS_ENABLED=0 turns them off, e.g. for the login and signup
+# scenarios of run_benchmarks.
+RATE_LIMITS = {
+    'login': {'ip': (30, 60), 'email': (10, 300)},
+    'signup': {'ip': (10, 3600), 'email': (5, 3600)},
+    'password_reset': {'ip': (10, 3600), 'email': (3, 3600)},
+} if os.getenv('RATE_LIMITS_ENABLED', '1') == '1' else {}
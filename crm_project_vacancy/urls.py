@@ -17,8 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from custom_auth.decorators import login_exempt
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include("custom_auth.urls", namespace="auth")),
     path('customers/', include("crm.urls", namespace="crm")),
+    path('metrics', login_exempt(metrics_view), name='metrics'),
 ]
@@ -1,3 +1,28 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ApiToken, FailedEmail, EmailOutbox
+from .celery_tasks import send_confirmation_email
+
+@admin.register(FailedEmail)
+class FailedEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'attempts', 'created_at')
+    readonly_fields = ('recipients', 'subject', 'message', 'error', 'attempts', 'created_at')
+    actions = ['resend']
+
+    @admin.action(description="Resend selected emails")
+    def resend(self, request, queryset):
+        for failed_email in queryset:
+            send_confirmation_email.delay(failed_email.recipients, failed_email.subject, failed_email.message)
+        count = queryset.count()
+        queryset.delete()
+        self.message_user(request, f"Queued {count} emails for delivery.")
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'created_at', 'relayed_at', 'dispatched_at')
+    list_filter = (('dispatched_at', admin.EmptyFieldListFilter),)
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'created_at')
+    readonly_fields = ('key_hash',)
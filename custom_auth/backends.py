@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# v2 entries hold the session auth hash instead of the password hash.
+USER_CACHE_KEY = 'custom_auth:user:v2:{user_id}'
+USER_CACHE_TIMEOUT = 300
+USER_CACHE_FIELDS = ('id', 'email', 'email_verified')
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(USER_CACHE_KEY.format(user_id=user_id))
+
+
+class CachedModelBackend(ModelBackend):
+
+    # Serves request.user from the cache. The instance only has the hot fields
+    # loaded; anything else is fetched on first access like a deferred field,
+    # and save() writes back only the loaded fields. Sessions are verified
+    # against the cached session auth hash, so the password hash itself never
+    # leaves the database.
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        key = USER_CACHE_KEY.format(user_id=user_id)
+        # from_db() expects values in model field order.
+        field_names = [field.attname for field in UserModel._meta.concrete_fields if field.attname in USER_CACHE_FIELDS]
+
+        cached = cache.get(key)
+        if cached is None:
+            loaded = [field.attname for field in UserModel._meta.concrete_fields
+                      if field.attname in USER_CACHE_FIELDS or field.attname == 'password']
+            values = UserModel._default_manager.filter(pk=user_id).values_list(*loaded).first()
+            if values is None:
+                return None
+            user = UserModel.from_db(DEFAULT_DB_ALIAS, loaded, values)
+            values = tuple(getattr(user, name) for name in field_names)
+            cache.set(key, (values, user.get_session_auth_hash()), timeout=USER_CACHE_TIMEOUT)
+        else:
+            values, session_auth_hash = cached
+            user = UserModel.from_db(DEFAULT_DB_ALIAS, field_names, values)
+            user.cached_session_auth_hash = session_auth_hash
+
+        return user if self.user_can_authenticate(user) else None
@@ -1,34 +1,175 @@
-import socket
+import logging
+import time
 
-from time import sleep
-from django.core.mail import send_mail
+from datetime import timedelta
+from smtplib import SMTPException
 from celery import shared_task
+from celery.signals import worker_process_shutdown
+from celery.utils.time import get_exponential_backoff_interval
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 
-def is_internet_available(host="8.8.8.8", port=53, timeout=3):
+from crm_project_vacancy.metrics import QUEUE_BUCKETS, registry
 
-    try:
-        socket.setdefaulttimeout(timeout)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
-        return True
-    except socket.error:
-        return False
+from .mail import build_message, email_queue, mailer
+
+logger = logging.getLogger(__name__)
+
+EMAIL_MAX_RETRIES = 8
+EMAIL_RETRY_BACKOFF = 5
+EMAIL_RETRY_BACKOFF_MAX = 600
+EMAIL_OUTBOX_BATCH_SIZE = 500
+# A relayed row that is still not dispatched after this long is relayed
+# again. Longer than the largest retry countdown, which renews the lease.
+EMAIL_OUTBOX_LEASE = 900
+
+
+def count_email(event, value=1):
+    registry.inc('email_tasks_total', (('task', 'send_confirmation_email'), ('event', event)), value)
+
+
+def record_failed_email(recipients, subject, message, error, attempts):
+    from .models import FailedEmail
+
+    logger.error("Giving up on email to %s after %s attempts: %s", recipients, attempts, error)
+    return FailedEmail.objects.create(
+        recipients=list(recipients),
+        subject=subject,
+        message=message,
+        error=repr(error),
+        attempts=attempts,
+    )
+
+
+def mark_dispatched(*outbox_ids):
+    from .models import EmailOutbox
+
+    outbox_ids = [outbox_id for outbox_id in outbox_ids if outbox_id]
+    if outbox_ids:
+        EmailOutbox.objects.filter(id__in=outbox_ids).update(dispatched_at=timezone.now())
+
+
+def queue_email(email, subject, message):
+    queue_emails([{'to': list(email), 'subject': subject, 'message': message}])
+
+
+def queue_emails(payloads):
+    queued_at = time.time()
+    email_queue.push(*[{**payload, 'queued_at': queued_at} for payload in payloads])
+    count_email('queued', len(payloads))
+    registry.maybe_flush()
+
+    # Only the first push of a window schedules a flush; the rest ride along.
+    if email_queue.claim_flush(settings.EMAIL_BATCH_WINDOW):
+        flush_email_queue.apply_async(countdown=settings.EMAIL_BATCH_WINDOW)
+
+
+@shared_task
+def relay_email_outbox(batch_size=EMAIL_OUTBOX_BATCH_SIZE):
+    from .models import EmailOutbox
 
-@shared_task(bind=True)
-def send_confirmation_email(self, email, subject, message):
+    # Rows stay locked until they are marked relayed, so concurrent relays
+    # never pick up the same email twice, and the batch only reaches the mail
+    # queue once that commits. dispatched_at is set after the send; a message
+    # lost on the way (Redis, a worker dying mid-flush) goes out again once
+    # its lease runs out.
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(dispatched_at__isnull=True)
+            .filter(Q(relayed_at__isnull=True) | Q(relayed_at__lt=now - timedelta(seconds=EMAIL_OUTBOX_LEASE)))
+            .order_by('id')[:batch_size]
+        )
+        if not rows:
+            return 0
 
+        EmailOutbox.objects.filter(id__in=[row.id for row in rows]).update(relayed_at=now)
+        payloads = [row.as_payload() for row in rows]
+        transaction.on_commit(lambda: queue_emails(payloads))
+
+    return len(rows)
+
+
+@shared_task
+def flush_email_queue():
+
+    # Release first so messages queued while we send schedule the next flush.
+    email_queue.release_flush()
+
+    sent = 0
     while True:
-        if is_internet_available():
-            try:
-                send_mail(
-                        subject,
-                        message,
-                        settings.DEFAULT_FROM_EMAIL,
-                        email,
-                        fail_silently=False,
-                    )
-                break
-            except Exception:
-                sleep(5)
-        else:
-            sleep(5)
+        payloads = email_queue.pop_batch(settings.EMAIL_BATCH_SIZE)
+        if not payloads:
+            break
+
+        now = time.time()
+        for payload in payloads:
+            if 'queued_at' in payload:
+                registry.observe('email_queue_wait_seconds', (), now - payload['queued_at'], QUEUE_BUCKETS)
+
+        messages = [build_message(payload) for payload in payloads]
+        failed = mailer.send(messages)
+        sent += len(payloads) - len(failed)
+        count_email('sent', len(payloads) - len(failed))
+
+        delivered = []
+        for payload, message in zip(payloads, messages):
+            if message in failed:
+                count_email('retried')
+                send_confirmation_email.delay(message.to, message.subject, message.body, outbox_id=payload.get('outbox_id'))
+            else:
+                delivered.append(payload.get('outbox_id'))
+        mark_dispatched(*delivered)
+
+    registry.maybe_flush()
+    stats = mailer.stats()
+    logger.info(
+        "Flushed %s emails; %s messages over %s connections (%.1f per connection)",
+        sent, stats['messages_sent'], stats['connections_opened'], stats['messages_per_connection'],
+    )
+    return {'sent': sent, **stats}
+
+
+@shared_task(bind=True, max_retries=EMAIL_MAX_RETRIES, acks_late=True)
+def send_confirmation_email(self, email, subject, message, outbox_id=None):
+    from .models import EmailOutbox
+
+    payload = {'to': list(email), 'subject': subject, 'message': message}
+    try:
+        mailer.send_message(build_message(payload))
+    except (SMTPException, OSError) as exc:
+        attempts = self.request.retries + 1
+
+        # A direct call has no worker to retry it, and past max_retries the
+        # message goes to the dead-letter table instead of being dropped.
+        if self.request.called_directly or self.request.retries >= self.max_retries:
+            record_failed_email(email, subject, message, exc, attempts)
+            mark_dispatched(outbox_id)
+            count_email('failed')
+            registry.maybe_flush()
+            return False
+
+        countdown = get_exponential_backoff_interval(
+            EMAIL_RETRY_BACKOFF, self.request.retries, EMAIL_RETRY_BACKOFF_MAX, full_jitter=True
+        )
+        logger.warning("Email to %s failed (attempt %s), retrying in %ss: %s", email, attempts, countdown, exc)
+        count_email('retried')
+        registry.maybe_flush()
+        if outbox_id:
+            # Renew the lease so the relay does not send it a second time meanwhile.
+            EmailOutbox.objects.filter(id=outbox_id).update(relayed_at=timezone.now())
+        raise self.retry(exc=exc, countdown=countdown)
+
+    mark_dispatched(outbox_id)
+    count_email('sent')
+    registry.maybe_flush()
+    return True
+
+
+@worker_process_shutdown.connect
+def close_pooled_connection(**kwargs):
+    mailer.close()
+    registry.flush()
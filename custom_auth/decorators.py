@@ -0,0 +1,64 @@
+import math
+
+from functools import wraps
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.shortcuts import render
+
+from crm_project_vacancy.metrics import registry
+
+from .models import ApiToken
+from .ratelimit import buckets_for, rate_limiter
+
+
+def login_exempt(view):
+    # Marks a view (function or class-based) as reachable without logging in.
+    # LoginRequiredMiddleware collects marked views from the URLconf at startup.
+    view.login_exempt = True
+    return view
+
+
+def token_auth(view):
+    # Accepts "Authorization: Bearer <key>" for an ApiToken in place of a
+    # session. Token requests carry no cookies to forge, so only session
+    # requests get the CSRF check. Use with login_exempt: callers without
+    # either get a JSON 401 instead of the login redirect.
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer':
+            token = ApiToken.objects.select_related('user').filter(key_hash=ApiToken.hash_key(key.strip())).first()
+            if token is None or not token.user.is_active:
+                return JsonResponse({'success': False, 'error': 'Invalid API token'}, status=401)
+            request.user = token.user
+            return view(request, *args, **kwargs)
+
+        if not request.user.is_authenticated:
+            return JsonResponse({'success': False, 'error': 'Authentication required'}, status=401)
+        rejected = CsrfViewMiddleware(view).process_view(request, None, (), {})
+        if rejected is not None:
+            return rejected
+        return view(request, *args, **kwargs)
+
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+def rate_limit(scope):
+    # Answers 429 once the client IP or the submitted email has used up its
+    # settings.RATE_LIMITS[scope] bucket. Runs before the view, so throttled
+    # requests never reach a database lookup or a password hash.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            wait = rate_limiter.hit(buckets_for(scope, request))
+            if not wait:
+                return view(request, *args, **kwargs)
+
+            registry.inc('rate_limited_total', (('scope', scope),))
+            retry_after = max(math.ceil(wait), 1)
+            response = render(request, 'custom_auth/rate_limited.html', {'retry_after': retry_after}, status=429)
+            response['Retry-After'] = str(retry_after)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,141 @@
+import json
+import logging
+
+from collections import deque
+from smtplib import SMTPServerDisconnected
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+logger = logging.getLogger(__name__)
+
+EMAIL_QUEUE_KEY = 'custom_auth:email_queue'
+EMAIL_FLUSH_SCHEDULED_KEY = 'custom_auth:email_queue:flush_scheduled'
+
+
+def build_message(payload):
+    return EmailMessage(payload['subject'], payload['message'], settings.DEFAULT_FROM_EMAIL, payload['to'])
+
+
+class PooledMailer:
+
+    # Keeps one SMTP connection open per worker process so consecutive
+    # batches skip the TCP and TLS handshake.
+
+    def __init__(self):
+        self.connection = None
+        self.connections_opened = 0
+        self.messages_sent = 0
+        self.batches_sent = 0
+
+    def send_message(self, message):
+        try:
+            self._send_one(message)
+        except (SMTPServerDisconnected, OSError):
+            # The server may have dropped an idle connection; retry once on a fresh one.
+            self.close()
+            try:
+                self._send_one(message)
+            except Exception:
+                self.close()
+                raise
+
+    def send(self, messages):
+        # Returns the messages that could not be delivered, so the caller can
+        # hand them to the retrying task.
+        failed = []
+        for message in messages:
+            try:
+                self.send_message(message)
+            except Exception as exc:
+                logger.warning("Could not send email to %s over pooled connection: %s", message.to, exc)
+                failed.append(message)
+
+        self.batches_sent += 1
+        return failed
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+
+    def stats(self):
+        return {
+            'connections_opened': self.connections_opened,
+            'messages_sent': self.messages_sent,
+            'batches_sent': self.batches_sent,
+            'messages_per_connection': self.messages_sent / self.connections_opened if self.connections_opened else 0.0,
+        }
+
+    def _connect(self):
+        self.close()
+        self.connection = get_connection(fail_silently=False)
+        self.connection.open()
+        self.connections_opened += 1
+
+    def _send_one(self, message):
+        if self.connection is None:
+            self._connect()
+        message.connection = self.connection
+        self.connection.send_messages([message])
+        self.messages_sent += 1
+
+
+class EmailQueue:
+
+    # Collects outgoing messages until the next flush. Backed by a Redis list
+    # shared by all processes, or by a local deque when EMAIL_QUEUE_REDIS_URL
+    # is not configured (tests, local development). Popping is destructive;
+    # outbox emails lost after the pop are relayed again by relay_email_outbox.
+
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url
+        self._client = None
+        self._local = deque()
+        self._local_flush_scheduled = False
+
+    @property
+    def client(self):
+        if self._client is None and self.redis_url:
+            import redis
+
+            self._client = redis.Redis.from_url(self.redis_url)
+        return self._client
+
+    def push(self, *payloads):
+        if self.client is None:
+            self._local.extend(payloads)
+            return
+        self.client.rpush(EMAIL_QUEUE_KEY, *[json.dumps(payload) for payload in payloads])
+
+    def pop_batch(self, size):
+        if self.client is None:
+            batch = []
+            while self._local and len(batch) < size:
+                batch.append(self._local.popleft())
+            return batch
+        return [json.loads(item) for item in self.client.lpop(EMAIL_QUEUE_KEY, size) or []]
+
+    def claim_flush(self, window):
+        # True for the first caller in a window, who then schedules the flush.
+        if self.client is None:
+            claimed, self._local_flush_scheduled = not self._local_flush_scheduled, True
+            return claimed
+        return bool(self.client.set(EMAIL_FLUSH_SCHEDULED_KEY, 1, nx=True, px=max(int(window * 1000), 1) * 2))
+
+    def release_flush(self):
+        if self.client is None:
+            self._local_flush_scheduled = False
+            return
+        self.client.delete(EMAIL_FLUSH_SCHEDULED_KEY)
+
+    def __len__(self):
+        if self.client is None:
+            return len(self._local)
+        return self.client.llen(EMAIL_QUEUE_KEY)
+
+
+mailer = PooledMailer()
+email_queue = EmailQueue(settings.EMAIL_QUEUE_REDIS_URL)
@@ -0,0 +1,39 @@
+import timeit
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from custom_auth.middleware import LoginRequiredMiddleware
+
+
+class Command(BaseCommand):
+    help = "Measure the per-request overhead of LoginRequiredMiddleware."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        middleware = LoginRequiredMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+        iterations = options['iterations']
+
+        cases = [
+            ('public view, anonymous', '/auth/login', AnonymousUser()),
+            ('protected view, logged in', '/customers/', get_user_model()(pk=1)),
+            ('protected view, anonymous (redirect)', '/customers/', AnonymousUser()),
+        ]
+
+        for label, path, user in cases:
+            request = factory.get(path)
+            request.user = user
+            match = resolve(path)
+
+            seconds = timeit.timeit(
+                lambda: middleware.process_view(request, match.func, match.args, match.kwargs),
+                number=iterations,
+            )
+            self.stdout.write(f"{label:<40} {seconds / iterations * 1e9:10.0f} ns/request")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from custom_auth.models import ApiToken, User
+
+
+class Command(BaseCommand):
+    help = "Issue an API token for a user and print its key, which is not stored."
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument('--name', default='api')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['email']).first()
+        if user is None:
+            raise CommandError(f"No user with email {options['email']}.")
+        self.stdout.write(ApiToken.issue(user, options['name']))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from custom_auth.celery_tasks import EMAIL_OUTBOX_BATCH_SIZE, relay_email_outbox
+from custom_auth.models import EmailOutbox
+
+
+class Command(BaseCommand):
+    help = "Drain the email outbox into the mail queue in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EMAIL_OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait when the outbox is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain what is pending and exit.")
+        parser.add_argument('--replay-since', help="Mark emails created since this ISO datetime as pending again.")
+
+    def handle(self, *args, **options):
+        if options['replay_since']:
+            since = parse_datetime(options['replay_since'])
+            if since is None:
+                raise CommandError("--replay-since must be an ISO datetime.")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            replayed = EmailOutbox.objects.filter(created_at__gte=since).update(relayed_at=None, dispatched_at=None)
+            self.stdout.write(f"Marked {replayed} emails for replay.")
+
+        while True:
+            relayed = relay_email_outbox(options['batch_size'])
+            if relayed:
+                self.stdout.write(f"Relayed {relayed} emails.")
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['interval'])
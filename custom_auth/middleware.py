@@ -1,43 +1,40 @@
-import re
 from django.shortcuts import redirect
-from django.urls import reverse
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
 
-class LoginRequiredMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+from crm_project_vacancy.middleware import AsyncCapableMiddleware
 
-        self.allowed_paths = {
-            reverse('auth:main'),
-            reverse('auth:login'),
-            reverse('auth:signup'),
-            reverse('auth:password_reset'),
-            reverse('auth:logout')
-        }
 
-        self.allowed_patterns = [
-            re.compile(r'^/auth/confirm_email/[^/]+/[^/]+/$'),
-            re.compile(r'^/auth/reset/\d+/[^/]+/$'),
-        ]
+def is_login_exempt(callback):
+    view_class = getattr(callback, 'view_class', None)
+    return getattr(callback, 'login_exempt', False) or getattr(view_class, 'login_exempt', False)
 
-        self.allowed_view_names = {'confirm_email', 'reset_password_confirm'}
 
-    def __call__(self, request):
-        if not request.user.is_authenticated and not self.is_allowed_path(request):
-            return redirect(reverse('auth:login'))
+def collect_exempt_views(patterns):
+    exempt = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            exempt |= collect_exempt_views(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and is_login_exempt(pattern.callback):
+            exempt.add(pattern.callback)
+    return exempt
 
-        return self.get_response(request)
 
-    def is_allowed_path(self, request):
-        path = request.path
-        resolver_match = request.resolver_match
+class LoginRequiredMiddleware(AsyncCapableMiddleware):
 
-        if path in self.allowed_paths:
-            return True
+    # Runs in process_view, after URL resolution, so the check is a single set
+    # lookup on the resolved callback. Public views never touch request.user,
+    # which keeps the session and user rows from being loaded for them.
+    # Requests that do not resolve (404s) are left to the URL resolver.
 
-        if any(pattern.match(path) for pattern in self.allowed_patterns):
-            return True
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.login_url = reverse('auth:login')
+        self.exempt_views = frozenset(collect_exempt_views(get_resolver().url_patterns))
 
-        if resolver_match and resolver_match.view_name in self.allowed_view_names:
-            return True
+    def __call__(self, request):
+        return self.get_response(request)
 
-        return False
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if view_func in self.exempt_views or request.user.is_authenticated:
+            return None
+        return redirect(self.login_url)
@@ -1,13 +1,12 @@
+import hashlib
 import uuid
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.utils.crypto import get_random_string
 from django.urls import reverse
 from django.utils import timezone
 
-from .celery_tasks import send_confirmation_email as send_confirmation_email_celery
-
 
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -36,21 +35,94 @@ class User(AbstractBaseUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
+    # Set by CachedModelBackend, whose users are loaded without the password.
+    cached_session_auth_hash = None
+
+    def get_session_auth_hash(self):
+        if self.cached_session_auth_hash is not None:
+            return self.cached_session_auth_hash
+        return super().get_session_auth_hash()
+
+    def set_password(self, raw_password):
+        self.cached_session_auth_hash = None
+        super().set_password(raw_password)
+
     def send_confirmation_email(self, request):
 
-        if not self.confirmation_token:
-            self.confirmation_token = get_random_string(length=64)
-            self.save()
+        with transaction.atomic():
+            if not self.confirmation_token:
+                self.confirmation_token = get_random_string(length=64)
+                self.save(update_fields=['confirmation_token'])
 
-        confirmation_link = request.build_absolute_uri(
-            reverse('auth:confirm_email', args=[str(self.uid), self.confirmation_token])
-        )
+            confirmation_link = request.build_absolute_uri(
+                reverse('auth:confirm_email', args=[str(self.uid), self.confirmation_token])
+            )
 
-        send_confirmation_email_celery([self.email], 'Activate your account', f'Here is the link to activate your account: {confirmation_link}')
+            EmailOutbox.objects.create(
+                recipients=[self.email],
+                subject='Activate your account',
+                message=f'Here is the link to activate your account: {confirmation_link}'
+            )
 
     def activate_account(self):
 
         self.is_active = True
         self.email_verified = True
         self.confirmation_token = None
-        self.save(update_fields=['is_active', 'email_verified', 'confirmation_token'])
\ No newline at end of file
+        self.save(update_fields=['is_active', 'email_verified', 'confirmation_token'])
+
+class FailedEmail(models.Model):
+    recipients = models.JSONField()
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    error = models.TextField()
+    attempts = models.PositiveIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)}"
+
+
+class EmailOutbox(models.Model):
+    recipients = models.JSONField()
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    # Set when the row is handed to the mail queue; dispatched_at only once
+    # SMTP accepted the message or it was dead-lettered.
+    relayed_at = models.DateTimeField(blank=True, null=True)
+    dispatched_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(dispatched_at__isnull=True), name='auth_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)}"
+
+    def as_payload(self):
+        return {'to': self.recipients, 'subject': self.subject, 'message': self.message, 'outbox_id': self.id}
+
+
+class ApiToken(models.Model):
+    # Lets scripts call JSON endpoints marked with token_auth without a
+    # session. Only a SHA-256 of the key is stored; create_api_token shows
+    # the key once.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.user})"
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, user, name):
+        key = get_random_string(length=48)
+        cls.objects.create(user=user, name=name, key_hash=cls.hash_key(key))
+        return key
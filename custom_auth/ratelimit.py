@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'custom_auth:ratelimit'
+
+# KEYS are the buckets, ARGV holds capacity and period for each of them in
+# order. A token is taken from every bucket or from none; the result is 0 or
+# the seconds until the emptiest bucket holds a token again. Redis' own clock
+# keeps the buckets consistent across web servers.
+TOKEN_BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = capacity / tonumber(ARGV[2 * i])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+end
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        redis.call('HSET', key, 'tokens', levels[i] - 1, 'ts', now)
+        redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[2 * i])))
+    end
+end
+return tostring(wait)
+"""
+
+
+def client_ip(request):
+    # Behind RATE_LIMIT_TRUSTED_PROXIES reverse proxies, REMOTE_ADDR is the
+    # nearest proxy. Each proxy appends the address it was reached from to
+    # X-Forwarded-For, so the client is that many entries from the right;
+    # anything further left was sent by the client and is ignored.
+    proxies = settings.RATE_LIMIT_TRUSTED_PROXIES
+    if proxies:
+        forwarded = [address.strip() for address in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+        forwarded = [address for address in forwarded if address]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR') or 'unknown'
+
+
+def buckets_for(scope, request):
+    # (key, capacity, period) for every bucket settings.RATE_LIMITS defines
+    # for the scope. Emails are normalized and hashed so one address cannot
+    # dodge its bucket by case and no address is stored in Redis.
+    limits = settings.RATE_LIMITS.get(scope, {})
+    identities = {'ip': client_ip(request)}
+    email = request.POST.get('email', '').strip().lower()
+    if email:
+        identities['email'] = email
+
+    buckets = []
+    for kind, (capacity, period) in limits.items():
+        if kind in identities:
+            digest = hashlib.sha256(identities[kind].encode()).hexdigest()[:32]
+            buckets.append((f'{KEY_PREFIX}:{scope}:{kind}:{digest}', capacity, period))
+    return buckets
+
+
+class RateLimiter:
+
+    # Token buckets: each holds up to `capacity` tokens and refills at
+    # capacity/period per second, so a client may burst up to capacity and
+    # then continues at the average rate. Kept in Redis and updated by one Lua
+    # script per request, or in a local dict when RATE_LIMIT_REDIS_URL is not
+    # configured (tests, local development).
+
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url
+        self._client = None
+        self._script = None
+        self._local = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None and self.redis_url:
+            import redis
+
+            self._client = redis.Redis.from_url(self.redis_url)
+            self._script = self._client.register_script(TOKEN_BUCKET_SCRIPT)
+        return self._client
+
+    def hit(self, buckets):
+        # Returns 0 when the request may go ahead, otherwise the seconds to wait.
+        if not buckets:
+            return 0
+        if self.client is None:
+            return self._hit_local(buckets)
+        try:
+            args = [value for _, capacity, period in buckets for value in (capacity, period)]
+            return float(self._script(keys=[key for key, _, _ in buckets], args=args))
+        except Exception as exc:
+            # Locking everyone out while Redis is down is worse than no limit.
+            logger.warning("Rate limiter unavailable, letting request through: %s", exc)
+            return 0
+
+    def reset(self):
+        with self._lock:
+            self._local.clear()
+
+    def _hit_local(self, buckets):
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            wait = 0
+            for key, capacity, period in buckets:
+                rate = capacity / period
+                tokens, ts = self._local.get(key, (capacity, now))
+                tokens = min(capacity, tokens + max(0, now - ts) * rate)
+                levels.append(tokens)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+
+            if not wait:
+                for (key, _, _), tokens in zip(buckets, levels):
+                    self._local[key] = (tokens - 1, now)
+            return wait
+
+
+rate_limiter = RateLimiter(settings.RATE_LIMIT_REDIS_URL)
@@ -1,14 +1,30 @@
 import uuid
 
-from django.test import TestCase, RequestFactory
-from django.urls import reverse
+from datetime import timedelta
+from io import StringIO
+from smtplib import SMTPServerDisconnected
+from unittest.mock import patch
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse, resolve
+from django.http import HttpResponse
 from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.contrib.messages import get_messages
 from django.utils import timezone
 from django.utils.crypto import get_random_string
+from crm_project_vacancy.metrics import registry
 
+from .backends import CachedModelBackend
 from .forms import PasswordResetRequestForm
+from .models import ApiToken, FailedEmail, EmailOutbox
+from .celery_tasks import send_confirmation_email, flush_email_queue, queue_emails, relay_email_outbox, EMAIL_MAX_RETRIES, EMAIL_OUTBOX_LEASE
+from .mail import PooledMailer, email_queue
+from .middleware import LoginRequiredMiddleware
+from .ratelimit import RateLimiter, rate_limiter
 
 class MainPageTests(TestCase):
 
@@ -28,6 +44,7 @@ class MainPageTests(TestCase):
 class SignUpViewTest(TestCase):
 
     def setUp(self):
+        rate_limiter.reset()
         self.signup_url = reverse('auth:signup')
         self.user_model = get_user_model()
         self.factory = RequestFactory()
@@ -50,6 +67,12 @@ class SignUpViewTest(TestCase):
 
         self.assertIsNotNone(user.confirmation_token)
 
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailOutbox.objects.filter(recipients=[data['email']]).count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            relay_email_outbox()
+
         self.assertEqual(len(mail.outbox), 1)
         self.assertIn('Activate your account', mail.outbox[0].subject)
 
@@ -233,6 +256,7 @@ class LoginViewTest(TestCase):
         self.user.set_password('TestPassword123')
         self.user.save()
         self.login_url = reverse('auth:login')
+        rate_limiter.reset()
 
     def test_login_success(self):
 
@@ -277,6 +301,7 @@ class PasswordResetRequestViewTest(TestCase):
             uid=uuid.uuid4()
         )
         self.password_reset_url = reverse('auth:password_reset')
+        rate_limiter.reset()
 
     def test_get_request(self):
 
@@ -292,6 +317,10 @@ class PasswordResetRequestViewTest(TestCase):
         self.user.refresh_from_db()
         self.assertIsNotNone(self.user.reset_password_token)
 
+        self.assertEqual(len(mail.outbox), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            relay_email_outbox()
+
         self.assertEqual(len(mail.outbox), 1)
         self.assertIn('Activate your account', mail.outbox[0].subject)
         self.assertIn(self.user.reset_password_token, mail.outbox[0].body)
@@ -358,4 +387,329 @@ class CustomLogoutViewTest(TestCase):
         self.assertRedirects(response, self.main_url)
 
         response = self.client.get(self.main_url)
-        self.assertContains(response, 'Registration', status_code=200)
\ No newline at end of file
+        self.assertContains(response, 'Registration', status_code=200)
+
+class SendConfirmationEmailTaskTests(TestCase):
+
+    def test_sends_email(self):
+
+        result = send_confirmation_email.apply(args=(['user@example.com'], 'Subject', 'Body'))
+
+        self.assertTrue(result.get())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['user@example.com'])
+
+    @patch('custom_auth.celery_tasks.mailer.send_message')
+    def test_retries_then_dead_letters(self, mock_send_mail):
+
+        mock_send_mail.side_effect = SMTPServerDisconnected('Connection unexpectedly closed')
+
+        with self.assertLogs('custom_auth.celery_tasks', level='WARNING'):
+            send_confirmation_email.apply(args=(['user@example.com'], 'Subject', 'Body'))
+
+        self.assertEqual(mock_send_mail.call_count, EMAIL_MAX_RETRIES + 1)
+        failed_email = FailedEmail.objects.get()
+        self.assertEqual(failed_email.recipients, ['user@example.com'])
+        self.assertEqual(failed_email.attempts, EMAIL_MAX_RETRIES + 1)
+
+    @override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1', EMAIL_PORT=1, EMAIL_USE_TLS=False, EMAIL_TIMEOUT=1,
+    )
+    def test_direct_call_does_not_block_when_smtp_is_down(self):
+
+        with patch('custom_auth.celery_tasks.mailer', PooledMailer()), self.assertLogs('custom_auth.celery_tasks', level='ERROR'):
+            self.assertFalse(send_confirmation_email(['user@example.com'], 'Subject', 'Body'))
+
+        self.assertEqual(FailedEmail.objects.get().attempts, 1)
+
+
+class EmailBatchingTests(TestCase):
+
+    def test_flush_sends_batch_over_one_connection(self):
+
+        for i in range(3):
+            email_queue.push({'to': [f'user{i}@example.com'], 'subject': 'Subject', 'message': 'Body'})
+
+        with patch('custom_auth.celery_tasks.mailer', PooledMailer()):
+            result = flush_email_queue.apply().get()
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(len(email_queue), 0)
+        self.assertEqual(result['connections_opened'], 1)
+        self.assertEqual(result['messages_per_connection'], 3.0)
+
+    def test_email_task_metrics(self):
+
+        cache.clear()
+        queue_emails([{'to': ['metrics@example.com'], 'subject': 'Subject', 'message': 'Body'}])
+        flush_email_queue()
+
+        samples = registry.collect()
+        self.assertGreaterEqual(samples['email_tasks_total{task="send_confirmation_email",event="queued"}'], 1)
+        self.assertGreaterEqual(samples['email_tasks_total{task="send_confirmation_email",event="sent"}'], 1)
+        self.assertGreaterEqual(samples['email_queue_wait_seconds_count'], 1)
+
+    def test_mailer_reconnects_after_disconnect(self):
+
+        pooled_mailer = PooledMailer()
+        pooled_mailer.send([mail.EmailMessage('Subject', 'Body', to=['first@example.com'])])
+
+        with patch.object(pooled_mailer.connection, 'send_messages', side_effect=SMTPServerDisconnected()):
+            failed = pooled_mailer.send([mail.EmailMessage('Subject', 'Body', to=['second@example.com'])])
+
+        self.assertEqual(failed, [])
+        self.assertEqual(pooled_mailer.connections_opened, 2)
+        self.assertEqual([message.to for message in mail.outbox], [['first@example.com'], ['second@example.com']])
+
+
+class EmailOutboxTests(TestCase):
+
+    def test_outbox_row_rolls_back_with_request_transaction(self):
+
+        user = get_user_model().objects.create(email='rollback@example.com')
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            user.send_confirmation_email(RequestFactory().get('/'))
+            raise RuntimeError
+
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_relay_dispatches_pending_rows_once(self):
+
+        for i in range(3):
+            EmailOutbox.objects.create(recipients=[f'user{i}@example.com'], subject='Subject', message='Body')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(relay_email_outbox(batch_size=2), 2)
+            self.assertEqual(relay_email_outbox(batch_size=2), 1)
+            self.assertEqual(relay_email_outbox(batch_size=2), 0)
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(EmailOutbox.objects.filter(dispatched_at__isnull=True).exists())
+
+    def test_replay_since(self):
+
+        EmailOutbox.objects.create(recipients=['user@example.com'], subject='Subject', message='Body')
+        with self.captureOnCommitCallbacks(execute=True):
+            relay_email_outbox()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('relay_email_outbox', once=True, replay_since='2000-01-01T00:00:00', stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_relay_queues_nothing_when_its_transaction_rolls_back(self):
+
+        EmailOutbox.objects.create(recipients=['user@example.com'], subject='Subject', message='Body')
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError), transaction.atomic():
+            relay_email_outbox()
+            raise RuntimeError
+
+        self.assertEqual(len(email_queue), 0)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertIsNone(EmailOutbox.objects.get().relayed_at)
+
+    def test_email_lost_before_sending_is_relayed_again(self):
+
+        outbox = EmailOutbox.objects.create(recipients=['user@example.com'], subject='Subject', message='Body')
+
+        # The flush pops the batch and then dies before SMTP sees it.
+        with patch('custom_auth.celery_tasks.mailer.send', side_effect=RuntimeError), self.captureOnCommitCallbacks(execute=True):
+            relay_email_outbox()
+
+        outbox.refresh_from_db()
+        self.assertEqual(len(email_queue), 0)
+        self.assertIsNone(outbox.dispatched_at)
+        self.assertEqual(relay_email_outbox(), 0)
+
+        EmailOutbox.objects.update(relayed_at=timezone.now() - timedelta(seconds=EMAIL_OUTBOX_LEASE + 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(relay_email_outbox(), 1)
+
+        outbox.refresh_from_db()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNotNone(outbox.dispatched_at)
+
+    def test_retried_email_is_dispatched_once_sent(self):
+
+        outbox = EmailOutbox.objects.create(recipients=['user@example.com'], subject='Subject', message='Body')
+
+        # The batch send fails and the message goes to the retrying task instead.
+        with patch('custom_auth.celery_tasks.mailer.send', side_effect=lambda messages: messages):
+            with self.captureOnCommitCallbacks(execute=True):
+                relay_email_outbox()
+
+        outbox.refresh_from_db()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNotNone(outbox.dispatched_at)
+
+class LoginRequiredMiddlewareTests(TestCase):
+
+    def test_anonymous_user_is_redirected_from_protected_view(self):
+
+        response = self.client.get(reverse('crm:customer_list'))
+
+        self.assertRedirects(response, reverse('auth:login'), fetch_redirect_response=False)
+
+    def test_public_view_does_not_touch_user(self):
+
+        middleware = LoginRequiredMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get(reverse('auth:signup'))
+        match = resolve(request.path)
+
+        # No request.user at all: an exempt view must not need it.
+        self.assertIsNone(middleware.process_view(request, match.func, match.args, match.kwargs))
+
+    def test_confirm_and_reset_links_are_public(self):
+
+        confirm = self.client.get(reverse('auth:confirm_email', kwargs={'uid': uuid.uuid4(), 'token': 'x'}))
+        reset = self.client.get(reverse('auth:reset_password_confirm', kwargs={'uid': 1, 'token': 'x'}))
+
+        self.assertEqual(confirm.status_code, 404)
+        self.assertEqual(reset.status_code, 404)
+
+class ApiTokenTests(TestCase):
+
+    def test_create_api_token_stores_only_the_hash(self):
+
+        user = get_user_model().objects.create(email='api@example.com')
+        out = StringIO()
+
+        call_command('create_api_token', 'api@example.com', name='importer', stdout=out)
+
+        key = out.getvalue().strip()
+        token = ApiToken.objects.get(user=user)
+        self.assertEqual(token.name, 'importer')
+        self.assertEqual(token.key_hash, ApiToken.hash_key(key))
+        self.assertNotIn(key, token.key_hash)
+
+class CachedUserBackendTests(TestCase):
+
+    def setUp(self):
+
+        cache.clear()
+        self.user = get_user_model().objects.create(email="cached@example.com", email_verified=True)
+        self.user.set_password("testpassword123")
+        self.user.save()
+
+    def test_user_is_served_from_cache(self):
+
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+
+        with self.assertNumQueries(0):
+            user = backend.get_user(self.user.pk)
+
+        self.assertEqual(user.email, "cached@example.com")
+        self.assertTrue(user.email_verified)
+
+    def test_password_hash_is_not_cached(self):
+
+        backend = CachedModelBackend()
+        session_auth_hash = self.user.get_session_auth_hash()
+        backend.get_user(self.user.pk)
+
+        cached = repr(cache.get(f"custom_auth:user:v2:{self.user.pk}"))
+        self.assertNotIn(self.user.password, cached)
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get_user(self.user.pk).get_session_auth_hash(), session_auth_hash)
+
+    def test_cache_invalidated_on_activation_and_password_change(self):
+
+        backend = CachedModelBackend()
+        self.user.email_verified = False
+        self.user.save(update_fields=['email_verified'])
+        self.assertFalse(backend.get_user(self.user.pk).email_verified)
+
+        self.user.email_verified = True
+        self.user.confirmation_token = None
+        self.user.save(update_fields=['email_verified', 'confirmation_token'])
+        self.assertTrue(backend.get_user(self.user.pk).email_verified)
+
+        self.user.set_password("newpassword123")
+        self.user.save()
+        self.assertTrue(backend.get_user(self.user.pk).check_password("newpassword123"))
+
+    def test_logged_in_page_view_skips_session_and_user_queries(self):
+
+        self.client.login(email="cached@example.com", password="testpassword123")
+        self.client.get(reverse('crm:customer_list'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('crm:customer_list'))
+
+        self.assertEqual(response.status_code, 200)
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('django_session', tables)
+        self.assertNotIn('custom_auth_user', tables)
+
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        rate_limiter.reset()
+        self.user = get_user_model().objects.create(email="limited@example.com", email_verified=True, uid=uuid.uuid4())
+        self.login_url = reverse('auth:login')
+
+    @override_settings(RATE_LIMITS={'login': {'ip': (2, 60)}})
+    def test_login_throttled_per_ip_before_any_query(self):
+
+        for _ in range(2):
+            response = self.client.post(self.login_url, {'email': 'limited@example.com', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 200)
+
+        # No user lookup, so no password check either.
+        with self.assertNumQueries(0):
+            response = self.client.post(self.login_url, {'email': 'limited@example.com', 'password': 'testpassword123'})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertTemplateUsed(response, 'custom_auth/rate_limited.html')
+
+    @override_settings(RATE_LIMITS={'password_reset': {'email': (1, 3600)}})
+    def test_password_reset_throttled_per_email(self):
+
+        url = reverse('auth:password_reset')
+        self.assertEqual(self.client.post(url, {'email': 'limited@example.com'}).status_code, 302)
+        self.assertEqual(self.client.post(url, {'email': ' Limited@Example.com'}).status_code, 429)
+
+        # Another address from the same client is not affected.
+        get_user_model().objects.create(email="other@example.com", email_verified=True, uid=uuid.uuid4())
+        self.assertEqual(self.client.post(url, {'email': 'other@example.com'}).status_code, 302)
+
+    @override_settings(RATE_LIMITS={'signup': {'ip': (1, 3600)}})
+    def test_get_requests_are_not_limited(self):
+
+        url = reverse('auth:signup')
+        self.assertEqual(self.client.post(url, {'email': 'new@example.com'}).status_code, 302)
+        self.assertEqual(self.client.post(url, {'email': 'new@example.com'}).status_code, 429)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(RATE_LIMITS={'login': {'ip': (1, 3600)}}, RATE_LIMIT_TRUSTED_PROXIES=1)
+    def test_client_ip_behind_trusted_proxy(self):
+
+        def post(forwarded_for):
+            return self.client.post(
+                self.login_url, {'email': 'limited@example.com', 'password': 'wrong'}, HTTP_X_FORWARDED_FOR=forwarded_for,
+            ).status_code
+
+        self.assertEqual(post('203.0.113.1'), 200)
+        self.assertEqual(post('203.0.113.2'), 200)
+        # Entries left of the one the proxy added are the client's own.
+        self.assertEqual(post('198.51.100.7, 203.0.113.1'), 429)
+
+    def test_bucket_refills_over_time(self):
+
+        limiter = RateLimiter()
+        buckets = [('ip', 2, 10), ('email', 5, 10)]
+        with patch('custom_auth.ratelimit.time.monotonic', return_value=100.0):
+            self.assertEqual(limiter.hit(buckets), 0)
+            self.assertEqual(limiter.hit(buckets), 0)
+            self.assertAlmostEqual(limiter.hit(buckets), 5.0)
+        with patch('custom_auth.ratelimit.time.monotonic', return_value=105.0):
+            self.assertEqual(limiter.hit(buckets), 0)
+            self.assertGreater(limiter.hit(buckets), 0)
+
+        # A rejected request takes no token from the buckets that had one.
+        self.assertAlmostEqual(limiter._local['email'][0], 4.0)
@@ -1,5 +1,6 @@
 from django.urls import path
 from . import views
+from .decorators import login_exempt
 
 app_name = "auth"
 
@@ -10,5 +11,5 @@ urlpatterns = [
     path('auth/confirm_email/<str:uid>/<str:token>/', views.ConfirmEmailView.as_view(), name='confirm_email'),
     path('auth/password_reset/', views.PasswordResetRequestView.as_view(), name='password_reset'),
     path('auth/reset/<int:uid>/<str:token>/', views.PasswordResetConfirmView.as_view(), name='reset_password_confirm'),
-    path('auth/logout', views.LogoutView.as_view(), name='logout')
+    path('auth/logout', login_exempt(views.LogoutView.as_view()), name='logout')
 ]
@@ -3,13 +3,16 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth import authenticate, login, get_user_model
 from django.contrib.auth.views import LogoutView
 from django.contrib import messages
+from django.db import transaction
 from django.urls import reverse, reverse_lazy
 from django.utils.crypto import get_random_string
+from django.utils.decorators import method_decorator
 
-from .models import User
+from .decorators import login_exempt, rate_limit
+from .models import User, EmailOutbox
 from .forms import SignUpForm, LoginForm, PasswordResetForm, PasswordResetRequestForm
-from .celery_tasks import send_confirmation_email as send_confirmation_email_celery
 
+@login_exempt
 class MainPage(View):
     template_name = 'custom_auth/main.html'
     context_object_name = 'main'
@@ -20,6 +23,8 @@ class MainPage(View):
         }
         return render(request, self.template_name, context)
 
+@login_exempt
+@method_decorator(rate_limit('signup'), name='post')
 class SignUpView(View):
     def get(self, request):
         form = SignUpForm()
@@ -37,8 +42,11 @@ class SignUpView(View):
             user = form.save(commit=False)
             user.set_password(form.cleaned_data['password'])
             user.is_active = False
-            user.save()
-            user.send_confirmation_email(request)
+            user.confirmation_token = get_random_string(length=64)
+
+            with transaction.atomic():
+                user.save()
+                user.send_confirmation_email(request)
 
             return render(request, 'custom_auth/email_verification_prompt.html', {'user': user})
 
@@ -53,6 +61,7 @@ class SignUpView(View):
 
         return render(request, 'custom_auth/signup.html', {'form': form})
 
+@login_exempt
 class ConfirmEmailView(View):
     def get(self, request, uid, token):
 
@@ -75,6 +84,8 @@ class ConfirmEmailView(View):
             messages.error(request, "Invalid or expired confirmation link.")
             return redirect('auth:signup')
 
+@login_exempt
+@method_decorator(rate_limit('login'), name='post')
 class LoginView(View):
     template_name = 'custom_auth/login.html'
 
@@ -111,6 +122,8 @@ class LoginView(View):
 
         return render(request, self.template_name, {'form': form})
 
+@login_exempt
+@method_decorator(rate_limit('password_reset'), name='post')
 class PasswordResetRequestView(View):
     def get(self, request):
         form = PasswordResetRequestForm()
@@ -123,20 +136,25 @@ class PasswordResetRequestView(View):
             user = User.objects.get(email=email)
             token = get_random_string(32)
 
-            user.reset_password_token = token
-            user.save()
-
             reset_link = request.build_absolute_uri(
                 reverse('auth:reset_password_confirm', kwargs={'uid': user.id, 'token': token})
             )
 
-            send_confirmation_email_celery([email], 'Activate your account', f'Here is the link to activate your account: {reset_link}')
+            with transaction.atomic():
+                user.reset_password_token = token
+                user.save(update_fields=['reset_password_token'])
+                EmailOutbox.objects.create(
+                    recipients=[email],
+                    subject='Activate your account',
+                    message=f'Here is the link to activate your account: {reset_link}'
+                )
 
             messages.success(request, 'Password recovery instructions have been sent to your email.')
             return redirect('auth:login')
 
         return render(request, 'custom_auth/password_reset_request.html', {'form': form})
 
+@login_exempt
 class PasswordResetConfirmView(View):
     def get(self, request, uid, token):
         user = get_object_or_404(User, id=uid, reset_password_token=token)